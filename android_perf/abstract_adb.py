@@ -1,10 +1,18 @@
 
 import abc
+import subprocess
+import threading
 import types
+import uuid
+
+from .log import default as log
 
 
 class AdbInterface(metaclass=abc.ABCMeta):
     # 基础ADB通讯接口抽象
+    SHELL_SEP = '__SEP__'
+    # 是否可在多个线程中同时执行命令。python-adb 只有一条USB通讯流，并发执行会导致数据错乱
+    thread_safe = False
 
     @abc.abstractmethod
     def run_shell(self, cmd: str, clean_wrap=False) -> str:
@@ -16,6 +24,52 @@ class AdbInterface(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError
 
+    def run_shell_many(self, cmds: list, clean_wrap=False) -> list:
+        """
+        将多条命令合并为一次adb shell执行，减少通讯往返
+        :param cmds: 命令内容列表
+        :param clean_wrap: 是否清理每条结果的首尾空白
+        :return: 与命令一一对应的输出结果
+        """
+        rs = self.run_shell(f'; echo {self.SHELL_SEP}; '.join(cmds))
+        return [x.strip() if clean_wrap else x.strip('\r\n') for x in rs.split(self.SHELL_SEP)]
+
+    def run_shell_sticky(self, cmd: str, clean_wrap=False) -> str:
+        """
+        通过常驻的 adb shell 会话执行命令，省去每次建立shell连接的开销。不支持的实现抛出 NotImplementedError
+        :param cmd: 命令内容
+        :param clean_wrap: 是否清理结果换行
+        :return:
+        """
+        raise NotImplementedError
+
+    def _stream_shell_lines(self, cmd: str) -> types.GeneratorType:
+        """
+        逐行迭代命令输出，避免先读取完整结果再切分。底层实现不支持流式输出时退回到 run_shell
+        :param cmd: 命令内容
+        :return: 每行输出结果迭代(不含换行符)
+        """
+        try:
+            chunks = self.stream_shell(cmd)
+        except NotImplementedError:
+            chunks = [self.run_shell(cmd)]
+        chunks = iter(chunks)
+        buf = ''
+        try:
+            for c in chunks:
+                buf += c
+                *lines, buf = buf.split('\n')
+                for ll in lines:
+                    yield ll.rstrip('\r')
+        except GeneratorExit:
+            if not self.thread_safe:
+                # 调用方提前结束迭代时读完剩余输出，避免残留的数据被同一连接上的下一条命令读到
+                for _ in chunks:
+                    pass
+            raise
+        if buf:
+            yield buf.rstrip('\r')
+
     @abc.abstractmethod
     def stream_shell(self, cmd: str) -> types.GeneratorType:
         """
@@ -52,3 +106,77 @@ class AdbInterface(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def devices(self):
         raise NotImplementedError
+
+
+class ShellClosedBeforeRun(EOFError):
+    """常驻shell会话在命令写入前已断开，命令未发送到设备，可以安全重试"""
+
+
+class PersistentShell:
+    """常驻的 `adb shell` 进程，命令通过stdin写入，以带退出码的结束标记分隔每条命令的输出"""
+
+    def __init__(self, serial: str = None):
+        self.serial = serial
+        self._marker = f'__END_{uuid.uuid4().hex}__'
+        self._lock = threading.Lock()
+        self._proc = None
+
+    def _open(self) -> subprocess.Popen:
+        if not self._proc or self._proc.poll() is not None:
+            args = ['adb', '-s', self.serial, 'shell'] if self.serial else ['adb', 'shell']
+            self._proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT)
+        return self._proc
+
+    def _run_once(self, cmd: str) -> str:
+        proc = self._open()
+        # 使用 { } 而非子shell，避免多fork一个进程；同时合并stderr，与 run_shell 的输出保持一致
+        try:
+            proc.stdin.write(f'{{ {cmd}\n}} 2>&1; echo {self._marker}$?\n'.encode('utf8'))
+            proc.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise ShellClosedBeforeRun(f'adb shell closed before running: {cmd}') from e
+        out = []
+        while True:
+            line = proc.stdout.readline()
+            if not line:
+                raise EOFError(f'adb shell closed while running: {cmd}')
+            line = line.decode('utf8', errors='replace')
+            idx = line.find(self._marker)
+            if idx != -1:
+                out.append(line[:idx])
+                return ''.join(out)
+            out.append(line)
+
+    def run(self, cmd: str, retry: int = 1) -> str:
+        """
+        :param retry: 命令写入前发现shell会话已断开(例如设备重连、adb server重启)时，重新建立会话并重试的次数。
+            命令已发送后才断开的，设备可能已执行该命令(如 am force-stop、rm 等有副作用的命令，或命令本身包含exit)，不重试直接抛出
+        """
+        with self._lock:
+            while True:
+                try:
+                    return self._run_once(cmd)
+                except ShellClosedBeforeRun:
+                    self._kill()
+                    if retry <= 0:
+                        raise
+                    retry -= 1
+                    log.warning(f'adb shell 会话已断开，重新连接后重试: {cmd}')
+                except EOFError:
+                    self._kill()
+                    raise
+
+    def _kill(self):
+        if self._proc:
+            try:
+                self._proc.stdin.close()
+                self._proc.terminate()
+                self._proc.wait(1)
+            except Exception:
+                self._proc.kill()
+            self._proc = None
+
+    def close(self):
+        with self._lock:
+            self._kill()
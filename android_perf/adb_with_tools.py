@@ -1,6 +1,12 @@
 # coding=utf8
+import io
 import time
-from urllib.parse import urlencode
+from urllib.parse import quote_plus
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from .base_adb import AdbProxy
 from .app_info import AppInfo
@@ -42,6 +48,18 @@ class AdbProxyWithTools(AdbProxy):
         self.check_tools_app()
         return self.launch_by_app(self.TOOLS_APP)
 
+    @property
+    def _tools_app_start_cmd(self) -> str:
+        # TOOLS_APP 为固定配置，启动指令前缀只需拼接一次(functools.cached_property 需 Python 3.8+)
+        cmd = self.__dict__.get('_tools_app_start_cmd_value')
+        if cmd is None:
+            cmd = self.__dict__['_tools_app_start_cmd_value'] = \
+                f'am start -n {self.TOOLS_APP.pkg}/{self.TOOLS_APP.run_args}'
+        return cmd
+
+    def launch_tools_app_with_args(self, *args: str):
+        return self.run_shell(f'{self._tools_app_start_cmd} {" ".join(args)}')
+
     def kill_tools_app(self):
         return self.kill_app(self.TOOLS_APP.pkg)
 
@@ -61,13 +79,12 @@ class AdbProxyWithScreenRecorder(AdbProxyWithTools):
         logging.info(f'修改录屏工具配置:\n自动停止结束录屏【{auto_stop_record}】\n录屏倒数【{record_count_down_second}】'
                      f'\n录屏自动切到后台【{record_auto2back}】'
                      f'\n录屏视频上传完毕自动删除【{record_auto_delete}】')
-        rs = self.launch_by_app_with_args(
-            self.TOOLS_APP,
+        rs = self.launch_tools_app_with_args(
             f'--es setting 1 --ez auto_2back {str(record_auto2back).lower()}',
             f'--ez auto_stop_record {str(auto_stop_record).lower()}',
             f'--ei record_count_down_second {record_count_down_second}',
             f'--ez record_auto_delete {str(record_auto_delete).lower()}')
-        if rs.find('Starting:') == -1:
+        if 'Starting:' not in rs:
             raise RuntimeError(f'修改录屏设置异常：`{rs}`')
 
     def start_screen_record(self, key: str = None):
@@ -76,10 +93,9 @@ class AdbProxyWithScreenRecorder(AdbProxyWithTools):
         :param key: 必须保证每次录屏采用不同的key，默认为None 则会自动生成。自定义的话，可以在后期进行筛查
         :return:
         """
-        rs = self.launch_by_app_with_args(
-            self.TOOLS_APP,
+        rs = self.launch_tools_app_with_args(
             f'--es ui startRecord --es key {key}')
-        if rs.find('Starting:') == -1:
+        if 'Starting:' not in rs:
             raise RuntimeError(f'启动录屏异常：`{rs}`')
 
     def stop_screen_record(self):
@@ -87,10 +103,9 @@ class AdbProxyWithScreenRecorder(AdbProxyWithTools):
         停止录屏。执行本方法后，记得预留一定时间(至少1秒)保证指令在工具App中正确执行以保存录屏视频文件，不要马上kill掉工具 (见 close方法)
         :return:
         """
-        rs = self.launch_by_app_with_args(
-            self.TOOLS_APP,
+        rs = self.launch_tools_app_with_args(
             f'--es ui stopRecording')
-        if rs.find('Starting:') == -1:
+        if 'Starting:' not in rs:
             raise RuntimeError(f'停止录屏异常：`{rs}`')
 
     def set_screen_record_upload_api(self, title: str, url: str, method: str, upload_file_arg_name: str,
@@ -105,25 +120,28 @@ class AdbProxyWithScreenRecorder(AdbProxyWithTools):
         :param body: 请求体，可选，内部可用占位参数值：$create_time
         :param body_need_encoding: 是否对body 进行编码，可选，默认：否
         """
-        hds = f'--es header {urlencode(headers)}'.replace("&", r"\&") if headers else ''
-        bds = f'--es body {urlencode(body)}'.replace("&", r"\&") if body else ''
-        rs = self.launch_by_app_with_args(
-            self.TOOLS_APP,
+        hds = f'--es header {self._shell_escaped_query(headers)}' if headers else ''
+        bds = f'--es body {self._shell_escaped_query(body)}' if body else ''
+        rs = self.launch_tools_app_with_args(
             f'--es data api',
             f'--es title {title} --es url {url} --es method {method}',
             f'--es uploadFileArgName {upload_file_arg_name}',
             f'--ez isBodyEncoding {str(body_need_encoding).lower()} {hds} {bds}'
         )
-        if rs.find('Starting:') == -1:
+        if 'Starting:' not in rs:
             raise RuntimeError(f'设置上传接口异常：`{rs}`')
 
+    @staticmethod
+    def _shell_escaped_query(d: dict) -> str:
+        # 等同于 urlencode 的结果，但直接以转义后的 `\&` 拼接，用于 adb shell 参数
+        return r'\&'.join(f'{quote_plus(str(k))}={quote_plus(str(v))}' for k, v in d.items())
+
     def notify_to_upload_screen_record(self, api_title: str, *video_keys: str):
-        rs = self.launch_by_app_with_args(
-            self.TOOLS_APP,
+        rs = self.launch_tools_app_with_args(
             f'--es data upload',
             f'--es apiTitle {api_title}',
             f'--es videoKeys {",".join(video_keys)}')
-        if rs.find('Starting:') == -1:
+        if 'Starting:' not in rs:
             raise RuntimeError(f'通知执行上传异常：`{rs}`')
 
 
@@ -137,17 +155,27 @@ class AdbProxyWithTrafficStatistics(AdbProxyWithTools):
             return f'/sdcard/Android/data/{self.TOOLS_APP.pkg}/files/tmp/net_test.log'
         return '/sdcard/tmp/mm.log'
 
-    def prepare_statistics_net_traffic(self, save2file: str = None):
-        self.kill_tools_app()
-        try:
-            self.del_file(save2file or self.NET_TRAFFIC_LOG_PATH)
-        except:
-            pass
-        self.start_tools_app()
-        while True:
+    def prepare_statistics_net_traffic(self, save2file: str = None, timeout: float = 10):
+        """
+        重启工具App，并等待其进程启动
+        :param save2file: 流量日志保存路径，可选
+        :param timeout: 等待工具App进程启动的最长时间，秒
+        """
+        self.check_tools_app()
+        # 关闭工具、清理旧日志、重新启动工具 合并为一次adb shell执行
+        self.run_shell_many([
+            f'am force-stop {self.TOOLS_APP.pkg}',
+            f'rm {save2file or self.NET_TRAFFIC_LOG_PATH}',
+            f'am start {self.TOOLS_APP.pkg}/{self.TOOLS_APP.run_args}'
+        ])
+        wait = 0.01
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
             if self.find_processes(self.TOOLS_APP.pkg):
-                break
-            time.sleep(0.1)
+                return
+            time.sleep(wait)
+            wait = min(wait * 2, 0.5)
+        raise TimeoutError(f'【{self.TOOLS_APP.name}】在{timeout}秒内未能启动')
 
     def start_statistics_net_traffic(self, app: AppInfo, save2file: str = None):
         return self.send_broadcast_2tools_app(
@@ -172,11 +200,11 @@ class AdbProxyWithTrafficStatistics(AdbProxyWithTools):
         self.stop_statistics_net_traffic()
         time.sleep(0.1)
         save2file = save2file or self.NET_TRAFFIC_LOG_PATH
-        logging.debug(f'Read File[{save2file}]...')
+        logging.debug('Read File[%s]...', save2file)
         rs = self.cat_file(save2file)
         self.del_file(save2file)
         self.kill_tools_app()
-        if rs.rfind('No such file or directory') != -1:
+        if 'No such file or directory' in rs:
             raise ValueError(f'流量日志记录文件访问异常，请确保该【{self.TOOLS_APP.name}】已经授权VPN权限、且开启文件权限。'
                              f'例如：进入【{self.TOOLS_APP.name}】 -> 【网络统计】 -> '
                              f'【授权日志文件】 -> 找到【{self.TOOLS_APP.name}】 -> 【授予所有文件的管理权限】 -> 返回 -> '
@@ -186,18 +214,27 @@ class AdbProxyWithTrafficStatistics(AdbProxyWithTools):
 
     def finish2format_statistics_net_traffic(self, save2file: str = None) -> list:
         rs = self.finish_statistics_net_traffic(save2file)
-        logging.debug(f'Result:\n{rs}')
+        logging.debug('Result:\n%s', rs)
         return self.format_net_traffic_log(rs)
 
     @staticmethod
-    def format_net_traffic_log(s: str) -> list:
-        out = []
-        for x in s.split('\n'):
-            if not x:
-                continue
-            info = x.split('\t')
-            out.append(dict(second=int(info[0]), down=int(info[1]), up=int(info[2])))
-        return out
+    def format_net_traffic_log(s: str, legacy=True):
+        """
+        解析流量统计日志，每行格式为：第N秒\t下载字节数\t上传字节数
+        :param s: 日志内容
+        :param legacy: 为True时返回 [{second: x, down: n, up: n}, ...]；
+            为False时使用numpy解析，返回 {'second': array, 'down': array, 'up': array}，适合较长时间的日志 (需安装numpy)
+        """
+        if not legacy:
+            if np is None:
+                raise ImportError('Parsing net traffic log into arrays requires numpy!')
+            if s.strip():
+                arr = np.loadtxt(io.StringIO(s), delimiter='\t', dtype=np.int64, usecols=(0, 1, 2), ndmin=2)
+            else:
+                arr = np.empty((0, 3), dtype=np.int64)
+            return {'second': arr[:, 0], 'down': arr[:, 1], 'up': arr[:, 2]}
+        return [{'second': int(a), 'down': int(b), 'up': int(c)}
+                for a, b, c, *_ in (x.split('\t') for x in s.splitlines() if x)]
 
     def _sync_net_traffic_statistics(self, app: AppInfo, wait_seconds=10) -> str:
         """
@@ -208,8 +245,15 @@ class AdbProxyWithTrafficStatistics(AdbProxyWithTools):
         # 获取结果格式,每行为1秒内的数据:
         # 第N秒\t下载字节数\t上传字节数
         """
-        self.kill_by_app(app)
-        self.prepare_and_start_statistics_net_traffic(app)
+        # 关闭目标App 与 重启监测工具 互不依赖，底层实现支持并发时同时执行
+        if self._impl.thread_safe:
+            kill = self._pool.submit(self.kill_by_app, app)
+            self.prepare_statistics_net_traffic()
+            kill.result()
+        else:
+            self.kill_by_app(app)
+            self.prepare_statistics_net_traffic()
+        self.start_statistics_net_traffic(app)
         time.sleep(0.1)
         self.launch_by_app(app)
         time.sleep(wait_seconds)
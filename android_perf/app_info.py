@@ -2,15 +2,11 @@
 
 
 class AppInfo(object):
-    name = None
-    alias = None
-    pkg = None
-    platform = None
-    version = None
-    description = None
-    run_args = None
+    __slots__ = ('name', 'alias', 'pkg', 'platform', 'version', 'description', 'run_args')
 
     def __init__(self, info_json: dict = None):
+        for s in AppInfo.__slots__:
+            setattr(self, s, None)
         if info_json:
             self._load_by_json(info_json)
 
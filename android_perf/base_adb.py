@@ -1,14 +1,31 @@
+import functools
+import time
 import types
 from abc import ABCMeta
+from concurrent.futures import ThreadPoolExecutor, Future
 import re
 
 from .abstract_adb import AdbInterface
 from .app_info import AppInfo
-from .cpu import CPUUsageAdb
-from .memory import MemoryAdb
-from .traffic import TrafficAdb
+from .process import ProcessAdb
+from .cache import cached_method
+from .cpu import CPUUsageAdb, SysCPU, AppCPU
+from .data_unit import DataUnit, KB
+from .memory import MemoryAdb, MemoryInfo, DeviceMemoryInfo
+from .traffic import TrafficAdb, NetTraffic
 from .log import default as log
 
+__all__ = ['AndroidDevice', 'AdbBase', 'AdbProxy']
+
+
+# 设备序列号 -> 设备属性(系统版本、SDK版本、型号、品牌)，这些属性在设备运行期间不会改变
+_device_props_cache = {}
+
+
+@functools.lru_cache(maxsize=None)
+def _launch_activity_re(app_bundle: str):
+    return re.compile(rf'\+ Using main activity (\S+) \(from package {re.escape(app_bundle)}\)')
+
 
 class AndroidDevice(object):
     os_version = None
@@ -21,12 +38,24 @@ class AndroidDevice(object):
         return f'品牌:{self.brand} 型号:{self.model} Android {self.os_version} (SDK {self.sdk_version})'
 
 
-class AdbBase(AdbInterface, metaclass=ABCMeta):
+class AdbBase(ProcessAdb, metaclass=ABCMeta):
     """扩展较多常用指令操作的adb抽象"""
-    _sdk_version: int = None
 
     RE_APP_VERSION = re.compile(r'versionName=([\w\.]+)')
     RE_DUMPSYS_ACTIVITIES = re.compile(r'\{\w+ \w+ ([\w\.]+)/.+\}')
+    RE_USERID = re.compile(r'userId=(\d+)')
+    _resolution: tuple = None
+
+    def __init__(self):
+        self._prop_cache = {}
+
+    def clear_prop_cache(self):
+        """清理设备属性缓存，例如切换设备连接后"""
+        self._prop_cache.clear()
+        # 同一序列号(例如 ip:端口)可能已对应另一台设备，一并清理进程内共享的缓存
+        _device_props_cache.pop(self.get_device_serial(), None)
+        self.invalidate_process_cache()
+        self._resolution = None
 
     def input(self, s: str):
         rs = self.run_shell(f'input text {s}')
@@ -51,15 +80,15 @@ class AdbBase(AdbInterface, metaclass=ABCMeta):
 
     def get_launch_activity(self, app_bundle: str):
         rs = self.run_shell(f'monkey -c android.intent.category.LAUNCHER -p {app_bundle} -v -v -v 0')
+        pat = _launch_activity_re(app_bundle)
         for ll in rs.splitlines():
-            d = re.findall(rf'\+ Using main activity (\S+) \(from package {app_bundle}\)', ll)
-            if d:
-                return d[0]
+            m = pat.search(ll)
+            if m:
+                return m.group(1)
 
     def get_sdk_version(self) -> int:
-        if not self._sdk_version:
-            self._sdk_version = int(self.run_shell('getprop ro.build.version.sdk'))
-        return self._sdk_version
+        # SDK版本与其他设备属性一次读取并缓存，避免单独再执行一次 getprop
+        return int(self._get_device_props()[1])
 
     def set_http_proxy(self, host_port: str):
         """
@@ -68,7 +97,7 @@ class AdbBase(AdbInterface, metaclass=ABCMeta):
         :return:
         """
         rs = self.run_shell(f'settings put global http_proxy {host_port}')
-        if rs.find('Permission denial') == -1:
+        if 'Permission denial' not in rs:
             return rs
         raise RuntimeError('Wifi 代理因权限问题而设置失败，请尝试授权：'
                            '\n小米: 在开发者选项里，把“USB调试（安全设置）"打开即可; 或允许USB调试修改权限或模拟点击'
@@ -78,25 +107,37 @@ class AdbBase(AdbInterface, metaclass=ABCMeta):
         return self.set_http_proxy(':0')
 
     def get_device_resolution(self) -> (int, int):
-        k = '_resolution'
-        if not hasattr(self, k):
-            rs = re.split(r'\s+', self.run_shell('wm size').strip())
-            rs = rs[-1].split('x')
-            setattr(self, k, (int(rs[0]), int(rs[1])))
-        return getattr(self, k)
+        if self._resolution is None:
+            w, h = self.run_shell('wm size').split()[-1].split('x')
+            self._resolution = (int(w), int(h))
+        return self._resolution
+
+    @cached_method
+    def _get_device_props(self) -> tuple:
+        # 按序列号在进程内共享，不同的底层实现(PyAdb/PureAdb)连接同一设备时无需重复读取
+        serial = self.get_device_serial()
+        props = serial and _device_props_cache.get(serial)
+        if not props:
+            props = tuple(self.run_shell_many([
+                'getprop ro.build.version.release',
+                'getprop ro.build.version.sdk',
+                'getprop ro.product.model',
+                'getprop ro.product.brand'
+            ], clean_wrap=True))
+            if serial:
+                _device_props_cache[serial] = props
+        return props
 
     def get_device_info(self, dev: AndroidDevice = None) -> AndroidDevice:
         d = dev or AndroidDevice()
-        d.os_version = self.run_shell('getprop ro.build.version.release', True)
-        d.sdk_version = self.run_shell('getprop ro.build.version.sdk', True)
-        d.model = self.run_shell('getprop ro.product.model', True)
-        d.brand = self.run_shell('getprop ro.product.brand', True)
+        d.os_version, d.sdk_version, d.model, d.brand = self._get_device_props()
         d.account_password = ''
         return d
 
     def launch_app(self, app_pkg: str, activity: str = None):
         m = activity and f'am start {app_pkg}/{activity}' or \
             f'monkey -p {app_pkg} -c android.intent.category.LAUNCHER 1'
+        self.invalidate_process_cache(app_pkg)
         return self.run_shell(m)
 
     def launch_app_with_args(self, app_pkg: str, activity: str, *args: str):
@@ -104,6 +145,7 @@ class AdbBase(AdbInterface, metaclass=ABCMeta):
         ss = [activity]
         ss.extend(args)
         s = ' '.join(ss)
+        self.invalidate_process_cache(app_pkg)
         return self.run_shell(f'am start -n {app_pkg}/{s}')
 
     def launch_by_app_with_args(self, app: AppInfo, *args: str):
@@ -127,54 +169,34 @@ class AdbBase(AdbInterface, metaclass=ABCMeta):
         return self.run_shell(f'pm clear {app_bundle}')
 
     def kill_app(self, app_bundle: str):
+        self.invalidate_process_cache(app_bundle)
         return self.run_shell(f'am force-stop {app_bundle}', True)
 
     def kill_by_app(self, app: AppInfo):
         return self.kill_app(app.pkg)
 
     def dump_running_activities(self):
-        ats = self.run_shell('dumpsys activity activities | grep Activities')
+        # 在Python中过滤，省去设备上额外fork一个grep进程
+        ats = [x for x in self._stream_shell_lines('dumpsys activity activities') if 'Activities' in x]
         if not ats:
             log.warning('未有正在运行的Activity')
             return
-        pkg = self.RE_DUMPSYS_ACTIVITIES.findall(ats, re.M)
+        pkg = [p for x in ats for p in self.RE_DUMPSYS_ACTIVITIES.findall(x)]
         if not pkg:
-            log.warning('解析Activities 失败：%s', ats)
+            log.warning('解析Activities 失败：%s', '\n'.join(ats))
             return
         return pkg
 
     def force_stop_running_activities(self):
-        for p in self.dump_running_activities():
+        pkgs = self.dump_running_activities()
+        if not pkgs:
+            return
+        for p in pkgs:
             log.warning('杀掉应用：%s', p)
-            self.kill_app(p)
-
-    def find_processes(self, app_bundle: str) -> list:
-        """
-        每个app可能会有多个进程
-        :param app_bundle:
-        :return: list: [(进程ID，父进程ID，进程名)]
-        """
-        rs = self.run_shell(f'ps -A | grep {app_bundle}')
-        ll = []
-        for x in rs.split('\n'):
-            d = re.split(r'\s+', x)
-            if not d or not d[0]:
-                continue
-            try:
-                ll.append((d[1], d[2], d[-1]))
-            except Exception:
-                log.warning(f'格式化进程信息异常：{d}')
-        return ll
-
-    def find_process_ids(self, app_bundle: str) -> list:
-        return [p[0] for p in self.find_processes(app_bundle)]
-
-    def find_main_process_id(self, app_bundle: str) -> str:
-        for p in self.find_processes(app_bundle):
-            if p[-1].find(':') == -1:
-                return p[0]
-        raise ValueError('No Process Found!')
+            self.invalidate_process_cache(p)
+        return self.run_shell(';'.join(f'am force-stop {p}' for p in pkgs), True)
 
+    @cached_method
     def get_app_user_id(self, app_bundle: str):
         """
         获取某个应用在系统中分配的用户ID，通常一个应用(不论有多少进程)有全局唯一的用户ID
@@ -182,7 +204,7 @@ class AdbBase(AdbInterface, metaclass=ABCMeta):
         :return:
         """
         rs = self.run_shell(f'dumpsys package {app_bundle} | grep userId=')
-        u = re.findall(r'userId=(\d+)', rs)
+        u = self.RE_USERID.findall(rs)
         if u:
             return u[0]
         raise ValueError(f'Matching userId error: {rs}')
@@ -194,13 +216,12 @@ class AdbBase(AdbInterface, metaclass=ABCMeta):
         return self.run_shell(f'rm {file_path}')
 
     def send_broadcast(self, broadcast_action: str, *args: str, **kv: str):
-        vv = map(lambda x: f"-e {x[0]} {x[1]}", kv.items())
-        return self.run_shell(
-            f'am broadcast -a {broadcast_action} {" ".join(args)} {" ".join(vv)}')
+        extras = ''.join(f' -e {k} {v}' for k, v in kv.items())
+        return self.run_shell(f'am broadcast -a {broadcast_action} {" ".join(args)}{extras}')
 
     def ping(self, h: str) -> bool:
         rs = self.run_shell(f'ping -c 1 -W 1 {h}')
-        return rs.rfind('1 received') != -1
+        return '1 received' in rs
 
     def __enter__(self):
         return self
@@ -212,19 +233,112 @@ class AdbBase(AdbInterface, metaclass=ABCMeta):
 class AdbProxy(AdbBase, CPUUsageAdb, MemoryAdb, TrafficAdb):
     """ADB 代理，用于衔接adb协议的不同底层实现"""
 
-    def __init__(self, adb_implement: AdbInterface):
+    def __init__(self, adb_implement: AdbInterface, sticky_shell=False):
+        """
+        :param adb_implement: adb底层实现
+        :param sticky_shell: 是否优先使用常驻的adb shell会话执行命令(需底层实现支持 run_shell_sticky)
+        """
+        super().__init__()
         self._impl = adb_implement
+        self._sticky_shell = sticky_shell
+        self._pool = ThreadPoolExecutor(max_workers=4)  # 用于并发执行互不依赖的adb指令
+
+    @property
+    def thread_safe(self) -> bool:
+        return self._impl.thread_safe
 
     def run_shell(self, cmd: str, clean_wrap=False) -> str:
+        if self._sticky_shell:
+            try:
+                return self._impl.run_shell_sticky(cmd, clean_wrap=clean_wrap)
+            except NotImplementedError:
+                log.warning(f'{type(self._impl).__name__} 不支持常驻shell会话，改用普通 run_shell')
+                self._sticky_shell = False
         return self._impl.run_shell(cmd, clean_wrap=clean_wrap)
 
     def stream_shell(self, cmd: str) -> types.GeneratorType:
+        if self._sticky_shell:
+            # 常驻shell会话不支持流式读取，整体返回一次结果
+            return iter([self.run_shell(cmd)])
         return self._impl.stream_shell(cmd)
 
+    def get_tick_snapshot(self, pid_or_list, unit: DataUnit = None, use_dumpsys=True) -> (SysCPU, AppCPU, MemoryInfo):
+        """
+        一次adb shell同时读取系统CPU时间、CPU频率、目标进程的CPU时间以及内存数据
+        等同于 get_cpu_snapshot + get_processes_memory，但只需一次通讯往返
+        :param pid_or_list: 进程ID，或进程ID列表。为列表时会从中清理不存在的进程ID，与 get_cpu_snapshot 一致
+        :return: (系统CPU时间, 进程CPU时间汇总, 进程内存数据汇总)
+        """
+        is_list = isinstance(pid_or_list, list)
+        pl = pid_or_list if is_list else [pid_or_list]
+        targets = list(pl)
+        self.get_cpu_max_freq_sum()
+        start = int(time.monotonic() * 1000)
+        rs = self.run_shell_many(
+            ['cat /proc/stat|head -n 1', self.CPU_CUR_FREQ_CMD] +
+            [f'cat /proc/{p}/stat' for p in targets] +
+            [self._process_memory_cmd(p, use_dumpsys) for p in targets],
+            clean_wrap=True
+        )
+        end = int(time.monotonic() * 1000)
+        n = len(targets)
+        sys_cpu = self._parse_cpu_global(rs[0], self._parse_cpu_freq(rs[1]), end - start)
+        app_cpu = self._sum_processes_stat(pl, rs[2:2 + n], end - start)
+        if not is_list and not pl:
+            raise KeyError(f'No such process: {pid_or_list}')
+        alive = set(pl)
+        memory = self.sum_processes_memory(
+            self._parse_process_memory(m, start, p, unit, use_dumpsys)
+            for p, m in zip(targets, rs[2 + n:]) if p in alive
+        )
+        return sys_cpu, app_cpu, memory
+
+    def get_device_snapshot(self, unit: DataUnit = KB) -> (DeviceMemoryInfo, SysCPU, NetTraffic):
+        """
+        一次adb shell同时读取设备整机的内存、CPU时间与流量统计，
+        等同于 get_device_memory + get_cpu_global + get_device_traffic，但只需一次通讯往返
+        :param unit: 内存数据单位
+        """
+        self.get_cpu_max_freq_sum()
+        start = int(time.monotonic() * 1000)
+        rs = self.run_shell_many([
+            f'free -{unit.flag}', 'cat /proc/stat|head -n 1', self.CPU_CUR_FREQ_CMD, 'cat /proc/net/dev'
+        ], clean_wrap=True)
+        end = int(time.monotonic() * 1000)
+        return (
+            DeviceMemoryInfo(unit).parse(rs[0], start),
+            self._parse_cpu_global(rs[1], self._parse_cpu_freq(rs[2]), end - start),
+            self._traffic_parse(rs[3], start)
+        )
+
+    def kill_app_async(self, app_bundle: str) -> Future:
+        """
+        在后台结束应用，无需等待结果时使用。close 时会等待其执行完成，执行异常会记录到日志
+        底层实现不支持并发(thread_safe 为False，如 PyAdb)时直接同步执行，避免与调用方后续的命令同时使用同一连接
+        """
+        if self._impl.thread_safe:
+            f = self._pool.submit(self.kill_app, app_bundle)
+        else:
+            f = Future()
+            try:
+                f.set_result(self.kill_app(app_bundle))
+            except Exception as e:
+                f.set_exception(e)
+        f.add_done_callback(self._on_async_done)
+        return f
+
+    @staticmethod
+    def _on_async_done(f: Future):
+        e = f.exception()
+        if e:
+            log.error('后台执行adb指令异常', exc_info=e)
+
     def get_device_serial(self) -> str:
         return self._impl.get_device_serial()
 
     def close(self):
+        # 等待已提交的后台指令(如 kill_app_async)执行完成后再断开连接
+        self._pool.shutdown(wait=True)
         return self._impl.close()
 
     def install_app(self, apk_path):
@@ -0,0 +1,17 @@
+import functools
+
+
+def cached_method(fn):
+    """
+    缓存设备会话内不会改变的查询结果，以 (方法名, 参数) 为键保存在实例的 `_prop_cache` 中
+    注意：仅用于结果不可变的查询，例如 sdk版本、设备型号、应用userId 等
+    """
+    @functools.wraps(fn)
+    def wrapper(self, *args):
+        cache = self.__dict__.setdefault('_prop_cache', {})
+        k = (fn.__name__, args)
+        if k not in cache:
+            cache[k] = fn(self, *args)
+        return cache[k]
+
+    return wrapper
@@ -1,8 +1,13 @@
 from abc import ABCMeta
-import re
 import time
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from .abstract_adb import AdbInterface
+from .cache import cached_method
 from .log import default as logging
 
 
@@ -41,7 +46,9 @@ class SysCPU(CPUUsageBase):
 
 class CPUUsageAdb(AdbInterface, metaclass=ABCMeta):
     __cpu_scaling_max_freq_enable = True
+    CPU_CUR_FREQ_CMD = 'cat /sys/devices/system/cpu/cpu*/cpufreq/scaling_cur_freq'
 
+    @cached_method
     def get_cpu_count(self) -> int:
         c = self.run_shell('cat /proc/cpuinfo | grep ^processor | wc -l')
         return int(c)
@@ -55,6 +62,7 @@ class CPUUsageAdb(AdbInterface, metaclass=ABCMeta):
         f = self.run_shell(f'cat /sys/devices/system/cpu/cpu{idx}/cpufreq/scaling_cur_freq')
         return int(f)
 
+    @cached_method
     def get_cpu_x_max_freq(self, idx: int) -> int:
         """获取某个CPU核的最大频率
         /sys/devices/system/cpu/cpu{x}/cpufreq/ 目录下，cpuinfo_max_freq 和 scaling_max_freq 均有记录该CPU的最高频率，
@@ -81,17 +89,40 @@ class CPUUsageAdb(AdbInterface, metaclass=ABCMeta):
         logging.warning(on_error)
         return self.get_cpu_x_max_freq(idx)
 
+    def _cpu_freq_file(self) -> str:
+        return self.__cpu_scaling_max_freq_enable and 'scaling_max_freq' or 'cpuinfo_max_freq'
+
+    def get_all_cpu_max_freqs(self) -> list:
+        """一次adb shell读取所有CPU核的最大频率
+        读取规则与 get_cpu_x_max_freq 相同：scaling_max_freq 读取失败时改为读取 cpuinfo_max_freq
+        """
+        file = self._cpu_freq_file()
+        mx = self.run_shell(f'cat /sys/devices/system/cpu/cpu*/cpufreq/{file}')
+        try:
+            return [int(x) for x in mx.split()]
+        except ValueError:
+            on_error = f'文件`{file}`读取遇到错误: {mx}'
+        if file == 'cpuinfo_max_freq':
+            raise Exception(f'{on_error}\n无法继续进行测试\n'
+                            f'请尝试关闭手机的开发者模式，重启手机后再尝试重新开启开发者模式并开启USB调试后进行测试.')
+        self.__cpu_scaling_max_freq_enable = False
+        logging.warning(f'{on_error}\n现将尝试读取`cpuinfo_max_freq`数值，可能对最终结果造成一定的误差')
+        return self.get_all_cpu_max_freqs()
+
+    @cached_method
+    def get_cpu_max_freq_sum(self) -> int:
+        """所有CPU核最大频率之和，测试过程中不会改变，仅在首次调用时读取"""
+        return sum(self.get_all_cpu_max_freqs())
+
+    def _parse_cpu_freq(self, cur: str) -> float:
+        # 解析 CPU_CUR_FREQ_CMD 的输出，返回当前频率之和占最大频率之和的比例
+        return sum(int(x) for x in cur.split()) * 1.0 / self.get_cpu_max_freq_sum()
+
     def get_cpu_freq(self) -> float:
         """计算CPU当前频率占比
         :return 当前时刻所有CPU频率之和/所有CPU频率最大值之和
         """
-        c = self.get_cpu_count()
-        ct = 0
-        mt = 0
-        for i in range(c):
-            ct += self.get_cpu_x_curr_freq(i)
-            mt += self.get_cpu_x_max_freq(i)
-        return ct * 1.0 / mt
+        return self._parse_cpu_freq(self.run_shell(self.CPU_CUR_FREQ_CMD))
 
     def get_cpu_global(self) -> SysCPU:
         """
@@ -103,15 +134,67 @@ class CPUUsageAdb(AdbInterface, metaclass=ABCMeta):
         #
         # 1: 总的用户态时间
         # 3: 总的内核态时间
-        start = int(time.time() * 1000)
-        t = re.split(r'\s+', self.run_shell('cat /proc/stat|head -n 1'))
-        total = 0
-        for x in t[1:8]:
-            if not x:
+        start = int(time.monotonic() * 1000)
+        rs = self.run_shell('cat /proc/stat|head -n 1')
+        end = int(time.monotonic() * 1000)
+        return self._parse_cpu_global(rs, self.get_cpu_freq(), end - start)
+
+    @staticmethod
+    def _parse_cpu_global(rs: str, freq: float, cost_ms: int) -> SysCPU:
+        # 解析 /proc/stat 的第一行(cpu 汇总行)
+        t = rs.split()
+        return SysCPU(int(t[1]), int(t[3]), sum(int(x) for x in t[1:8]), freq, cost_ms)
+
+    def get_cpu_snapshot(self, process_id_list: list, auto_remove_miss_process=True) -> (SysCPU, AppCPU):
+        """
+        一次adb shell同时读取 /proc/stat、CPU频率 以及所有目标进程的 /proc/{pid}/stat，
+        等同于 get_cpu_global + get_processes_cpu_usage，但只需一次通讯往返
+        :param process_id_list: App的进程列表
+        :param auto_remove_miss_process: 是否从process_id_list中清理不存在进程ID
+        :return: (系统CPU时间, 目标App进程CPU时间汇总)
+        """
+        # 最大频率之和在首次读取后被缓存，此后每次快照只需读取当前频率
+        self.get_cpu_max_freq_sum()
+        start = int(time.monotonic() * 1000)
+        rs = self.run_shell_many(
+            ['cat /proc/stat|head -n 1', self.CPU_CUR_FREQ_CMD] + [f'cat /proc/{p}/stat' for p in process_id_list],
+            clean_wrap=True
+        )
+        end = int(time.monotonic() * 1000)
+        sys_cpu = self._parse_cpu_global(rs[0], self._parse_cpu_freq(rs[1]), end - start)
+        return sys_cpu, self._sum_processes_stat(process_id_list, rs[2:], end - start, auto_remove_miss_process)
+
+    def get_processes_stat_batch(self, process_id_list: list) -> list:
+        """
+        一次adb shell读取多个进程的 /proc/{pid}/stat
+        :return: 与 process_id_list 一一对应的原始输出
+        """
+        if not process_id_list:
+            return []
+        return self.run_shell_many([f'cat /proc/{p}/stat' for p in process_id_list], clean_wrap=True)
+
+    @staticmethod
+    def _sum_processes_stat(process_id_list: list, stats: list, cost_ms: int, auto_remove_miss_process=True) -> AppCPU:
+        # 汇总多个进程 /proc/{pid}/stat 的输出，stats 与 process_id_list 一一对应
+        total_u, total_s = 0, 0
+        miss_pids = set()
+        for pi, p in zip(process_id_list, stats):
+            if 'No such' in p:
+                # 进程有可能被销毁
+                logging.warning(f'process miss:{pi}')
+                miss_pids.add(pi)
                 continue
-            total += int(x)
-        end = int(time.time() * 1000)
-        return SysCPU(int(t[1]), int(t[3]), total, self.get_cpu_freq(), end - start)
+            if 'error' in p:
+                raise ValueError(f'Error return: {p}')
+            m = p.split()
+            # 13：utime 该进程用户态时间
+            # 14：stime 该进程内核态时间
+            total_u += int(m[13])
+            total_s += int(m[14])
+        if auto_remove_miss_process and miss_pids:
+            # 原地一次性过滤，调用方持有的列表同步更新
+            process_id_list[:] = [p for p in process_id_list if p not in miss_pids]
+        return AppCPU(total_u, total_s, cost_ms)
 
     def get_cpu_details(self, pid: str, for_all=False):
         """
@@ -120,14 +203,14 @@ class CPUUsageAdb(AdbInterface, metaclass=ABCMeta):
         # 参考 https://blog.csdn.net/houzhizhen/article/details/79474427
         """
         rs = self.run_shell(f'cat /proc/{pid}/stat')
-        if rs.find('No such') != -1:
+        if 'No such' in rs:
             # 进程有可能被销毁
             raise KeyError(f'Bad return: {rs}')
-        if rs.find('error') != -1:
+        if 'error' in rs:
             raise ValueError(f'Error return: {rs}')
         if for_all:
             return rs
-        m = re.split(r'\s+', rs)
+        m = rs.split()
         if m:
             return m
         raise ValueError(f'Format error: {rs}')
@@ -138,10 +221,10 @@ class CPUUsageAdb(AdbInterface, metaclass=ABCMeta):
         :param pid: 进程ID
         :return: (进程用户态所占CPU时间, 系统内核态所占CPU时间)
         """
-        logging.debug(f'Getting CPU usage on process {pid} ...')
-        start = int(time.time() * 1000)
+        logging.debug('Getting CPU usage on process %s ...', pid)
+        start = int(time.monotonic() * 1000)
         p = self.get_cpu_details(pid)
-        end = int(time.time() * 1000)
+        end = int(time.monotonic() * 1000)
         # 13：utime 该进程用户态时间
         # 14：stime 该进程内核态时间
         return AppCPU(int(p[13]), int(p[14]), end - start)
@@ -154,24 +237,35 @@ class CPUUsageAdb(AdbInterface, metaclass=ABCMeta):
         :param auto_remove_miss_process: 是否从process_id_list中清理不存在进程ID
         :return: 当前总的目标AppCPU时间
         """
-        total_u, total_s, cost_ms = 0, 0, 0
-        miss_pid_list = []
-        for pi in process_id_list:
-            try:
-                cpu_use = self.get_process_cpu_usage(pi)
-            except KeyError as e:
-                if str(e).find('No such') != -1:
-                    logging.warning(f'process miss:{pi}')
-                    miss_pid_list.append(pi)
-                    continue
-                raise e
-            total_u += cpu_use.user
-            total_s += cpu_use.kernel
-            cost_ms += cpu_use.cost_ms
-        if auto_remove_miss_process:
-            for xp in miss_pid_list:
-                process_id_list.remove(xp)
-        return AppCPU(total_s, total_s, cost_ms)
+        start = int(time.monotonic() * 1000)
+        stats = self.get_processes_stat_batch(process_id_list)
+        end = int(time.monotonic() * 1000)
+        return self._sum_processes_stat(process_id_list, stats, end - start, auto_remove_miss_process)
+
+    @classmethod
+    def compute_cpu_rates(cls, sys_cpu_list: list, app_cpu_list: list, is_normalized=True) -> list:
+        """
+        批量计算连续多个周期的App CPU占用率，等同于对相邻两项逐一调用 compute_cpu_rate 并取App占用率
+        安装了numpy时使用向量化计算，任一周期的系统CPU总时间增量为0时同样抛出 ZeroDivisionError
+        :param sys_cpu_list: 按时间顺序排列的系统CPU时间
+        :param app_cpu_list: 按时间顺序排列的应用CPU时间，与 sys_cpu_list 一一对应
+        :param is_normalized: 是否规范化
+        :return: 每个周期的App用户态+内核态占用率，长度为 len(sys_cpu_list) - 1
+        """
+        if np is None or len(sys_cpu_list) < 3:
+            return [
+                cls.compute_cpu_rate(sys_cpu_list[i - 1], sys_cpu_list[i], app_cpu_list[i - 1], app_cpu_list[i],
+                                     is_normalized)[0]
+                for i in range(1, len(sys_cpu_list))
+            ]
+        total = np.diff([c.total for c in sys_cpu_list])
+        if not total.all():
+            # 与 compute_cpu_rate 一致，系统CPU总时间没有增长时抛出异常，而不是得到 inf/nan
+            raise ZeroDivisionError('float division by zero')
+        rs = np.diff([a.user + a.kernel for a in app_cpu_list]) / total
+        if is_normalized:
+            rs *= np.array([c.freq for c in sys_cpu_list[1:]])
+        return rs.tolist()
 
     @staticmethod
     def compute_cpu_rate(
@@ -1,8 +1,16 @@
 
 class DataUnit:
-    def __init__(self, name: str, flag: str):
+    __slots__ = ('name', 'flag', '_div')
+
+    def __init__(self, name: str, flag: str, exp: int = 0):
+        """
+        :param name: 单位名称
+        :param flag: 单位标识，例如 free 命令的参数
+        :param exp: 相对byte的1024指数
+        """
         self.name = name
         self.flag = flag
+        self._div = 1 << (10 * exp)
 
     def __str__(self):
         return self.name
@@ -13,19 +21,11 @@ class DataUnit:
         :param value: 单位为byte的数据
         :return:
         """
-        if self.name == KB.name:
-            f = 1
-        elif self.name == MB.name:
-            f = 2
-        elif self.name == GB.name:
-            f = 3
-        else:
-            f = 0
-        return round(value / (1024 ** f), 2)
+        return round(value / self._div, 2)
 
 
-BYTE = DataUnit('Byte', 'b')
-KB = DataUnit('KB', 'k')
-MB = DataUnit('MB', 'm')
-GB = DataUnit('GB', 'g')
+BYTE = DataUnit('Byte', 'b', 0)
+KB = DataUnit('KB', 'k', 1)
+MB = DataUnit('MB', 'm', 2)
+GB = DataUnit('GB', 'g', 3)
 
@@ -3,17 +3,16 @@ import re
 import time
 
 from .abstract_adb import AdbInterface
+from .cache import cached_method
 from .log import default as logging
 from .data_unit import DataUnit, KB
 
 
 class MemoryInfo:
     RE_PROCESS = re.compile(r'\*\* MEMINFO in pid (\d+) \[(\S+)] \*\*')
-    RE_TOTAL_PSS = re.compile(r'TOTAL PSS:\s+(\d+)')
-    RE_TOTAL_PSS_HARMONY = re.compile(r'TOTAL:\s+(\d+)')
-    RE_JAVA_HEAP = re.compile(r"Java Heap:\s+(\d+)")
-    RE_NATIVE_HEAP = re.compile(r"Native Heap:\s+(\d+)")
-    RE_SYSTEM = re.compile(r"System:\s+(\d+)")
+    # 一次扫描取出所有需要的字段，TOTAL 为鸿蒙系统下的总PSS
+    RE_FIELDS = re.compile(r'(TOTAL PSS|TOTAL|Java Heap|Native Heap|System):\s+(\d+)')
+    RE_SMAPS_PSS = re.compile(r'^Pss:\s+(\d+) kB', re.M)
 
     def __init__(self, unit: DataUnit = None, is_harmony_os=False):
         self.pid = -1
@@ -30,27 +29,43 @@ class MemoryInfo:
         # 内存原始数据单位为Kilobytes，
         return self.unit.byte_exchange(float(num_str) * 1024)
 
-    def _parse(self, rs: str, start_ms: int):
-        end_ms = int(time.time() * 1000)
-        match = self.RE_PROCESS.search(rs)
-        self.pid = match.group(1)
-        self.process_name = match.group(2)
-        if self.is_harmony_os:
-            self.total_pss = self.number_format(self.RE_TOTAL_PSS_HARMONY.findall(rs)[0])
-        else:
-            self.total_pss = self.number_format(self.RE_TOTAL_PSS.findall(rs)[0])
-        self.java_heap = self.number_format(self.RE_JAVA_HEAP.findall(rs)[0])
-        self.native_heap = self.number_format(self.RE_NATIVE_HEAP.findall(rs)[0])
-        self.system = self.number_format(self.RE_SYSTEM.findall(rs)[0])
+    def _parse(self, rs: str, start_ms: int, header: tuple = None):
+        end_ms = int(time.monotonic() * 1000)
+        self.pid, self.process_name = header or self.RE_PROCESS.search(rs).groups()
+        fields = {}
+        for k, v in self.RE_FIELDS.findall(rs):
+            # 与原先 findall(...)[0] 一致，取第一次出现的值
+            fields.setdefault(k, v)
+        self.total_pss = self.number_format(fields[self.is_harmony_os and 'TOTAL' or 'TOTAL PSS'])
+        self.java_heap = self.number_format(fields['Java Heap'])
+        self.native_heap = self.number_format(fields['Native Heap'])
+        self.system = self.number_format(fields['System'])
         self.cost_ms = end_ms - start_ms
         return self
 
-    def parse(self, rs: str, start_ms: int):
+    def parse(self, rs: str, start_ms: int, header: tuple = None):
+        """
+        :param header: 已匹配的 (pid, 进程名)，调用方已匹配过 RE_PROCESS 时传入，避免重复扫描
+        """
         try:
-            return self._parse(rs, start_ms)
-        except IndexError:
+            return self._parse(rs, start_ms, header)
+        except (IndexError, KeyError):
             logging.warning(f'Parse Memory info error:\n{rs}')
 
+    def parse_smaps_rollup(self, rs: str, start_ms: int, pid: str):
+        """
+        解析 /proc/{pid}/smaps_rollup 的输出，仅能得到总PSS，Java/Native堆等细分数据为0
+        """
+        end_ms = int(time.monotonic() * 1000)
+        match = self.RE_SMAPS_PSS.search(rs)
+        if not match:
+            logging.warning(f'Parse smaps_rollup error:\n{rs}')
+            return
+        self.pid = pid
+        self.total_pss = self.number_format(match.group(1))
+        self.cost_ms = end_ms - start_ms
+        return self
+
     def __str__(self):
         return f'MemoryInfo Unit: {self.unit}\nCost(ms): {self.cost_ms}\n' \
                f'Pid: {self.pid}\nProcess: {self.process_name}\n' \
@@ -69,7 +84,7 @@ class DeviceMemoryInfo:
         self.unit = unit
 
     def parse(self, rs: str, start_ms: int):
-        end_ms = int(time.time() * 1000)
+        end_ms = int(time.monotonic() * 1000)
         match = self.RE_ALL.search(rs)
         self.total = match.group(1)
         self.used = match.group(2)
@@ -82,9 +97,12 @@ class DeviceMemoryInfo:
 
 
 class MemoryAdb(AdbInterface, metaclass=ABCMeta):
+    __smaps_rollup_enable = True
 
     @property
+    @cached_method
     def __is_harmony(self):
+        # 品牌在测试过程中不会改变，缓存结果避免每次读取内存数据都执行一次 getprop
         return self.run_shell('getprop ro.product.brand', True) == 'HUAWEI'
 
     def get_device_memory_details(self, unit: DataUnit):
@@ -92,7 +110,7 @@ class MemoryAdb(AdbInterface, metaclass=ABCMeta):
         return self.run_shell(f'free -{unit.flag}')
 
     def get_device_memory(self, unit: DataUnit = KB) -> DeviceMemoryInfo:
-        _t = int(time.time() * 1000)
+        _t = int(time.monotonic() * 1000)
         rs = self.get_device_memory_details(unit)
         return DeviceMemoryInfo(unit).parse(rs, _t)
 
@@ -102,23 +120,83 @@ class MemoryAdb(AdbInterface, metaclass=ABCMeta):
         """
         return self.run_shell(f'dumpsys meminfo {app_bundle_or_pid}')
 
-    def get_process_memory(self, app_bundle_or_pid: str, unit: DataUnit = None) -> MemoryInfo:
-        _t = int(time.time() * 1000)
+    def get_process_memory_fast(self, pid: str, unit: DataUnit = None) -> MemoryInfo:
+        """
+        通过 /proc/{pid}/smaps_rollup(Android 8+) 读取进程的总PSS，耗时远小于 dumpsys meminfo，但没有Java/Native堆等细分数据
+        设备不支持或无权限读取(非root设备通常无法读取其他应用的进程)时，改用 dumpsys meminfo
+        """
+        if self.__smaps_rollup_enable:
+            _t = int(time.monotonic() * 1000)
+            rs = self.run_shell(f'cat /proc/{pid}/smaps_rollup')
+            if 'Pss:' in rs:
+                return MemoryInfo(unit=unit).parse_smaps_rollup(rs, _t, pid)
+            if 'No such' not in rs:
+                # 文件存在但无法读取，之后不再尝试
+                self.__smaps_rollup_enable = False
+                logging.warning(f'无法读取smaps_rollup，改用dumpsys meminfo读取内存数据: {rs}')
+            # 文件不存在时可能是进程已销毁，也可能是系统版本不支持，交由 dumpsys meminfo 判断
+        return self.get_process_memory(pid, unit=unit)
+
+    def get_process_memory(self, app_bundle_or_pid: str, unit: DataUnit = None, use_dumpsys=True,
+                           retry: int = 3) -> MemoryInfo:
+        """
+        :param use_dumpsys: 为False时通过 get_process_memory_fast 读取，仅能得到总PSS，且只支持指定进程ID
+        :param retry: dumpsys meminfo 返回内容异常时的最多重试次数
+        """
+        if not use_dumpsys:
+            return self.get_process_memory_fast(app_bundle_or_pid, unit=unit)
+        _t = int(time.monotonic() * 1000)
         rs = self.get_process_memory_details(app_bundle_or_pid)
-        if rs.find('No process') != -1:
+        if 'No process' in rs:
             # 进程被销毁
             logging.warning(f'process miss:{app_bundle_or_pid}')
             return
-        if rs.find('MEMINFO in pid') == -1:
+        pos = rs.find('** MEMINFO in pid')
+        if pos == -1:
+            if retry <= 0:
+                logging.warning(f'Parse Memory info error:\n{rs}')
+                return
             logging.warning('try to get MemoryInfo again!')
-            return self.get_process_memory(app_bundle_or_pid)
-        return MemoryInfo(unit=unit, is_harmony_os=self.__is_harmony).parse(rs, _t)
-
-    def get_processes_memory(self, process_id_list: list, unit: DataUnit = None) -> MemoryInfo:
+            return self.get_process_memory(app_bundle_or_pid, unit=unit, retry=retry - 1)
+        # 标题行之前还有 Uptime 等内容，直接从标题行的位置开始锚定匹配，无需再扫描一遍
+        match = MemoryInfo.RE_PROCESS.match(rs, pos)
+        if not match:
+            logging.warning(f'Parse Memory info error:\n{rs}')
+            return
+        return MemoryInfo(unit=unit, is_harmony_os=self.__is_harmony).parse(rs, _t, match.groups())
+
+    def _process_memory_cmd(self, pid: str, use_dumpsys=True) -> str:
+        # 读取进程内存数据的命令，供与其他命令合并执行
+        if not use_dumpsys and self.__smaps_rollup_enable:
+            return f'cat /proc/{pid}/smaps_rollup'
+        return f'dumpsys meminfo {pid}'
+
+    def _parse_process_memory(self, rs: str, start_ms: int, pid: str, unit: DataUnit = None,
+                              use_dumpsys=True) -> MemoryInfo:
+        # 解析 _process_memory_cmd 的输出
+        if not use_dumpsys and 'Pss:' in rs:
+            return MemoryInfo(unit=unit).parse_smaps_rollup(rs, start_ms, pid)
+        pos = rs.find('** MEMINFO in pid')
+        match = pos != -1 and MemoryInfo.RE_PROCESS.match(rs, pos)
+        if match:
+            return MemoryInfo(unit=unit, is_harmony_os=self.__is_harmony).parse(rs, start_ms, match.groups())
+        # 进程已销毁、无权限读取等异常情况交由 get_process_memory 重新读取并处理
+        return self.get_process_memory(pid, unit=unit, use_dumpsys=use_dumpsys)
+
+    def get_processes_memory(self, process_id_list: list, unit: DataUnit = None, use_dumpsys=True) -> MemoryInfo:
         # 返回的 MemoryInfo 中进程信息为第一个进程的信息
+        return self.sum_processes_memory(
+            self.get_process_memory(pi, unit=unit, use_dumpsys=use_dumpsys) for pi in process_id_list
+        )
+
+    @staticmethod
+    def sum_processes_memory(memory_list) -> MemoryInfo:
+        """
+        汇总多个进程的内存数据，忽略为None(进程已销毁)的项
+        返回的 MemoryInfo 中进程信息为第一个进程的信息
+        """
         total: MemoryInfo = None
-        for pi in process_id_list:
-            m = self.get_process_memory(pi, unit=unit)
+        for m in memory_list:
             if not m:
                 continue
             if total:
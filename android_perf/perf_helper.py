@@ -2,8 +2,10 @@ import os
 import abc
 import time
 import datetime
+import threading
+from logging import DEBUG
 from decimal import Decimal
-from threadpool import ThreadPool, WorkRequest
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 
 from .cpu import SysCPU, AppCPU
 from .data_unit import DataUnit, MB
@@ -14,20 +16,43 @@ from .whistle import active_statistics_status, update_statistics_settings
 
 class AndroidPerfBaseHelper(metaclass=abc.ABCMeta):
 
-    def __init__(self, adb: AdbProxyWithToolsAll, main_process_only=False):
+    def __init__(self, adb: AdbProxyWithToolsAll, main_process_only=False, memory_by_dumpsys=True):
+        """
+        :param memory_by_dumpsys: 是否通过 dumpsys meminfo 读取内存数据，为False时优先读取 /proc/{pid}/smaps_rollup，
+            速度更快但仅有总PSS数据(测试结果只用到总PSS)，且非root设备可能无权限读取，此时自动改回 dumpsys meminfo
+        """
         self.adb = adb
         self.main_process_only = main_process_only
-        self._th_pool = ThreadPool(21)
+        self.memory_by_dumpsys = memory_by_dumpsys
+        # adb 底层实现(pure-python-adb、python-adb)均为同步接口，使用线程池并发读取。
+        # ThreadPoolExecutor 只在没有空闲线程时才创建新线程，每秒仅提交少量任务，实际线程数远小于上限
+        self._th_pool = ThreadPoolExecutor(max_workers=21, thread_name_prefix='perf')
+        # 已提交到 _th_pool 且尚未完成的任务，用于在测试结束时等待所有任务(包括任务中再提交的任务)完成
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        # 单独用于多进程内存读取的并发，避免在 _th_pool 的工作线程中等待同一线程池的任务而互相占满
+        self._fan_out_pool = ThreadPoolExecutor(max_workers=8)
+        # 多个线程会同时写入原始数据并触发计算，需保证同一时刻只有一个线程在修改原始数据或追加计算结果
+        self._compute_lock = threading.Lock()
+        # 用于提前结束 CPU/内存 测试，可在任意线程中调用 stop_test_cpu_memory 设置
+        self._stop = threading.Event()
         self.app = None
 
     @staticmethod
     def second2str(seconds: float) -> str:
+        m, s = divmod(int(seconds), 60)
         if seconds > 3600:
-            return '%d时%d分%d秒' % (seconds // 3600.0, seconds % 3600 // 60.0, seconds % 60)
-        return '%d分%d秒' % (seconds // 60.0, seconds % 60)
+            h, m = divmod(m, 60)
+            return f'{h}时{m}分{s}秒'
+        return f'{m}分{s}秒'
+
+    @staticmethod
+    def decimal_format(d, fm=Decimal('0.00')) -> float:
+        """按 fm 的小数位数四舍五入，返回float。需要 Decimal 类型时请使用 decimal_format_exact"""
+        return round(float(d), -fm.as_tuple().exponent)
 
     @staticmethod
-    def decimal_format(d, fm=Decimal('0.00')):
+    def decimal_format_exact(d, fm=Decimal('0.00')) -> Decimal:
         return Decimal(str(d)).quantize(fm)
 
     def set_app(self, app: AppInfo):
@@ -44,17 +69,60 @@ class AndroidPerfBaseHelper(metaclass=abc.ABCMeta):
         self.adb.kill_by_app(self.app)
 
     def get_cpu_usage(self, pid=None, pid_list=None) -> (SysCPU, AppCPU):
-        sys_cpu = self.adb.get_cpu_global()
+        # 系统CPU与进程CPU数据通过一次adb shell读取
         if pid:
-            return sys_cpu, self.adb.get_process_cpu_usage(pid)
-        return sys_cpu, self.adb.get_processes_cpu_usage(pid_list or self.adb.find_process_ids(self.app.pkg))
+            pl = [pid]
+            rs = self.adb.get_cpu_snapshot(pl)
+            if not pl:
+                raise KeyError(f'No such process: {pid}')
+            return rs
+        return self.adb.get_cpu_snapshot(pid_list or self.adb.find_process_ids(self.app.pkg))
 
     def get_memory_usage(self, pid=None, pid_list=None, unit: DataUnit = None):
         if pid:
-            return self.adb.get_process_memory(pid, unit=unit)
-        return self.adb.get_processes_memory(pid_list or self.adb.find_process_ids(self.app.pkg), unit=unit)
+            return self.adb.get_process_memory(pid, unit=unit, use_dumpsys=self.memory_by_dumpsys)
+        return self.get_processes_memory_parallel(pid_list or self.adb.find_process_ids(self.app.pkg), unit=unit)
+
+    def get_processes_memory_parallel(self, pid_list: list, unit: DataUnit = None):
+        """并发读取多个进程的内存数据并汇总，每个进程的 dumpsys meminfo 耗时较长
+        adb底层实现不支持并发(如 PyAdb)时逐个读取
+        """
+        if len(pid_list) < 2 or not self.adb.thread_safe:
+            return self.adb.get_processes_memory(pid_list, unit=unit, use_dumpsys=self.memory_by_dumpsys)
+        futures = [
+            self._fan_out_pool.submit(self.adb.get_process_memory, p, unit=unit, use_dumpsys=self.memory_by_dumpsys)
+            for p in pid_list
+        ]
+        # result() 会抛出读取过程中的异常
+        return self.adb.sum_processes_memory([f.result() for f in futures])
+
+    def _submit(self, fn, *args) -> Future:
+        # 提交任务到 _th_pool，并记录到 _pending 中
+        f = self._th_pool.submit(fn, *args)
+        with self._pending_lock:
+            self._pending.add(f)
+        f.add_done_callback(self._on_task_done)
+        return f
+
+    def _on_task_done(self, f: Future):
+        with self._pending_lock:
+            self._pending.discard(f)
+        e = f.exception()
+        if e:
+            logging.error('线程任务执行异常', exc_info=e)
+
+    def _wait_pending(self):
+        # 任务执行过程中可能会继续提交新的任务，需循环等待直到没有未完成的任务
+        while True:
+            with self._pending_lock:
+                pending = list(self._pending)
+            if not pending:
+                return
+            wait(pending)
 
     def exit(self, kill_tools=True, kill_process=True):
+        self._th_pool.shutdown(wait=False)
+        self._fan_out_pool.shutdown(wait=False)
         try:
             self.adb.close(kill_tools=kill_tools)
         except Exception as e:
@@ -67,74 +135,79 @@ class AndroidPerfBaseHelper(metaclass=abc.ABCMeta):
     def on_test_cpu_memory(self, current_second: int, max_listen_seconds: int, data: dict):
         """调用 start_test_cpu_memory后，在min_wait_seconds之后，每秒读取CPU、内存数据后要执行的操作。
         # 注意这里可能会在多个线程中执行(请做好状态同步)，执行耗时太长的操作会一直占用线程池资源。
-        另外，可通过 data['keep'] = True/False 来控制继续读取CPU，内存性能数据
+        另外，可通过 self.stop_test_cpu_memory() 或 data['keep'] = False 来提前结束读取CPU，内存性能数据
         """
         raise NotImplementedError
 
     def _async_on_test_cpu_memory(self, current_second: int, max_listen_seconds: int, min_wait_seconds: int,
                                   raw_data: dict, data: dict):
-        logging.debug(f'{datetime.datetime.now()} On Test {current_second}th second!')
-        if len(raw_data) < min_wait_seconds:
+        if logging.isEnabledFor(DEBUG):
+            # 关闭调试日志时(通常情况)省去每秒获取时间和拼接字符串的开销
+            logging.debug(f'{datetime.datetime.now()} On Test {current_second}th second!')
+        if len(data['cpu']) + 1 in raw_data:
+            # 没有新的待计算数据时无需加锁计算
+            with self._compute_lock:
+                self._compute_cpu_memory(raw_data, data)
+        if len(data['cpu']) < min_wait_seconds:
             # 取数少于n秒的不进行后续操作
             return
-        self.on_test_cpu_memory(current_second, max_listen_seconds, self._compute_cpu_memory(raw_data, data))
+        self.on_test_cpu_memory(current_second, max_listen_seconds, data)
 
     @staticmethod
     def _check_cpu_memory_data(idx: int, d: dict) -> bool:
         ok = True
         for k, v in d.items():
             if v is None:
-                logging.debug(f'第{idx}秒 {k}数据未完成采集！')
+                logging.debug('第%s秒 %s数据未完成采集！', idx, k)
                 ok = False
         return ok
 
     def _compute_cpu_memory(self, raw_data: dict, data: dict):
-        # 多个线程读取性能数据，计算时需重新按时序排列
-        sort_data = sorted(raw_data.items(), key=lambda x: x[0])
-        cpu_list = []
-        memory_list = []
-        for idx, d in enumerate(sort_data):
-            if idx == 0:
-                continue
-            f_d = sort_data[idx - 1][1]
-            if not self._check_cpu_memory_data(idx - 1, f_d):
-                continue
-            _d = d[1]
-            if not self._check_cpu_memory_data(idx, _d):
-                continue
-            cpu, _ = self.adb.compute_cpu_rate(f_d['cpu_g'], _d['cpu_g'], f_d['cpu_a'], _d['cpu_a'])
-            memory = _d['memory'].total_pss
-            logging.debug('current CPU:[%.2f], MEM:[%.2f]', cpu * 100, memory)
-            cpu_list.append(cpu)
-            memory_list.append(memory)
-        data['cpu'] = cpu_list
-        data['memory'] = memory_list
+        # 增量计算：raw_data 以秒数为键，data['cpu'] 的长度即为下一个待计算的秒数，
+        # 多个线程读取性能数据，完成顺序不定，只从上次计算的位置开始向后追加已采集完成的相邻两秒数据
+        # 已计算过的数据随即从 raw_data 中移除，raw_data 只保留尚未计算的窗口，不随测试时长增长
+        # 先找出从上次计算位置开始连续采集完成的数据，再一次性批量计算相邻两秒的CPU占用率
+        # 每秒的数据只需检查一次是否采集完成(第0秒为初始数据，其余秒数在上一轮已检查过)
+        idx = len(data['cpu'])
+        ready = [raw_data[idx]]
+        while idx + len(ready) in raw_data:
+            _d = raw_data[idx + len(ready)]
+            if not self._check_cpu_memory_data(idx + len(ready), _d):
+                break
+            ready.append(_d)
+        if len(ready) < 2:
+            return data
+        cpu_list = self.adb.compute_cpu_rates([d['cpu_g'] for d in ready], [d['cpu_a'] for d in ready])
+        memory_list = [d['memory'].total_pss for d in ready[1:]]
+        if logging.isEnabledFor(DEBUG):
+            for cpu, memory in zip(cpu_list, memory_list):
+                logging.debug('current CPU:[%.2f], MEM:[%.2f]', cpu * 100, memory)
+        data['cpu'].extend(cpu_list)
+        data['memory'].extend(memory_list)
+        # 最后一秒的数据保留，作为下一轮计算的前一秒
+        for i in range(idx, idx + len(ready) - 1):
+            del raw_data[i]
         return data
 
-    def _async_run_get_cpu(self, rs: dict, main_pid=None, pid_list=None):
-        assert main_pid or pid_list
+    def _async_run_get_cpu_memory(self, rs: dict, main_pid=None, pid_list=None, unit: DataUnit = None):
+        assert main_pid or pid_list is not None
         # 这部分性能读取有一定延时，需在线程中运行，否则会应用主进程计时的准确性
+        # 系统CPU、进程CPU与内存数据通过一次adb shell读取
         if self.main_process_only:
             if not main_pid:
                 raise ValueError('当前测试内容为针对App主进程测试，请在`on_start_cpu_memory_test`函数中返回主进程id')
-            curr_g, curr_a = self.get_cpu_usage(main_pid)
+            target = main_pid
         else:
-            curr_g, curr_a = self.get_cpu_usage(pid_list=pid_list)
-        logging.debug(f'System CPU:\n{curr_g}')
-        logging.debug(f'App CPU:\n{curr_a}')
+            # pid_list 由 _work_on_cpu_memory 每秒解析一次后传入，此处不再重复读取进程列表
+            target = pid_list if pid_list is not None else self.adb.find_process_ids(self.app.pkg)
+            if not target:
+                raise ValueError(f'未找到【{self.app.pkg}】的进程')
+        curr_g, curr_a, memory = self.adb.get_tick_snapshot(target, unit=unit, use_dumpsys=self.memory_by_dumpsys)
+        logging.debug('System CPU:\n%s', curr_g)
+        logging.debug('App CPU:\n%s', curr_a)
+        logging.debug('App Memory:\n%s', memory)
         rs['cpu_g'] = curr_g
         rs['cpu_a'] = curr_a
-
-    def _async_run_get_memory(self, rs: dict, main_pid=None, pid_list=None, unit: DataUnit = None):
-        assert main_pid or pid_list
-        # 这部分性能读取有一定延时，需在线程中运行，否则会应用主进程计时的准确性
-        if self.main_process_only:
-            if not main_pid:
-                raise ValueError('当前测试内容为针对App主进程测试，请在`on_start_cpu_memory_test`函数中返回主进程id')
-            memory = self.get_memory_usage(main_pid, unit=unit)
-        else:
-            memory = self.get_memory_usage(pid_list=pid_list, unit=unit)
-        logging.debug(f'App Memory:\n{memory}')
         rs['memory'] = memory
 
     @abc.abstractmethod
@@ -143,12 +216,7 @@ class AndroidPerfBaseHelper(metaclass=abc.ABCMeta):
         若测试的内容是针对主进程的，则必须在此函数返回启动后的待测App的主进程
         参考：
         # self.adb.launch_by_app(self.app)
-        # while True:
-        #     time.sleep(0.008)
-        #     try:
-        #         return self.adb.find_main_process_id(self.app.pkg)
-        #     except ValueError as e:
-        #         logging.warning(f'重试获取{self.app.pkg}主进程id...')
+        # return self.adb.wait_main_process_id(self.app.pkg)
         """
         raise NotImplementedError
 
@@ -156,13 +224,16 @@ class AndroidPerfBaseHelper(metaclass=abc.ABCMeta):
                             min_wait_seconds: int = 0, max_listen_seconds: int = 60):
         # App运行时可能会启动很多进程，每次测试之前重新读一次进程列表
         idx_data = {'cpu_g': None, 'cpu_a': None, 'memory': None}
-        tmp_data[idx + 1] = idx_data
-        pl = main_pid is None and self.adb.find_process_ids(self.app.pkg) or None
-        self._th_pool.putRequest(WorkRequest(self._async_run_get_cpu, args=(idx_data, main_pid, pl)))
-        self._th_pool.putRequest(WorkRequest(self._async_run_get_memory, args=(idx_data, main_pid, pl, MB)))
-        self._th_pool.putRequest(WorkRequest(self._async_on_test_cpu_memory, args=(idx, max_listen_seconds,
-                                                                                   min_wait_seconds,
-                                                                                   tmp_data, final_data)))
+        with self._compute_lock:
+            tmp_data[idx + 1] = idx_data
+        # 仅针对主进程测试时无需读取进程列表；否则每秒只解析一次，空列表也原样传入，不再触发二次读取
+        pl = None if self.main_process_only and main_pid else self.adb.find_process_ids(self.app.pkg)
+        self._submit(self._async_run_get_cpu_memory, idx_data, main_pid, pl, MB)
+        self._submit(self._async_on_test_cpu_memory, idx, max_listen_seconds, min_wait_seconds, tmp_data, final_data)
+
+    def stop_test_cpu_memory(self):
+        """提前结束正在进行的 CPU/内存 测试，start_test_cpu_memory 会在等待已提交的任务完成后返回"""
+        self._stop.set()
 
     def start_test_cpu_memory(self, min_wait_seconds: int = 0, max_listen_seconds: int = 60) -> dict:
         assert self.app
@@ -175,22 +246,27 @@ class AndroidPerfBaseHelper(metaclass=abc.ABCMeta):
             # 多线程执行每一秒的性能数据读取，但是每个线程执行过程中可能会出现失败而进行重试读取，有一定延时现象，因此需要以该线程第一次读取发起读取的时间作为键，保证数据的正确先后顺序
             # 获取未启动应用时的系统CPU使用时间，将目标App CPU使用时间初始为0
         }
+        self._stop.clear()
         main_pid = self.on_start_cpu_memory_test()
         try:
+            # 以绝对时间为准每秒触发一次，避免每轮 sleep(1) 加上提交任务的耗时逐秒累积偏移
+            deadline = time.monotonic()
             for i in range(max_listen_seconds):
                 if not data['keep']:
                     break
                 # 1秒读一次数据，耗时操作放在线程中执行，以确保读取数据的操作为每秒执行一次
-                time.sleep(1)
+                # 等待期间调用 stop_test_cpu_memory 可立即结束，无需等到下一秒
+                deadline += 1
+                if self._stop.wait(max(0, deadline - time.monotonic())):
+                    break
                 if i > 0:
-                    latest_data = tmp_data[i-1]
-                    if latest_data['cpu_a'] is None or latest_data['memory'] is None:
+                    # 已完成计算的数据会被移除，不存在时说明该秒数据已采集完成
+                    latest_data = tmp_data.get(i - 1)
+                    if latest_data and (latest_data['cpu_a'] is None or latest_data['memory'] is None):
                         raise ValueError(f'【{self.app.pkg}】进程已不存在，无法继续读取相关CPU、内存信息')
-                self._th_pool.putRequest(WorkRequest(self._work_on_cpu_memory, args=(
-                    data, tmp_data, i, main_pid, min_wait_seconds, max_listen_seconds
-                )))
+                self._submit(self._work_on_cpu_memory, data, tmp_data, i, main_pid, min_wait_seconds, max_listen_seconds)
         finally:
-            self._th_pool.wait()
+            self._wait_pending()
             # 等待所有线程结束
         return data
 
@@ -329,7 +405,7 @@ class AndroidPerfBaseHelper(metaclass=abc.ABCMeta):
             new = self.adb.get_device_traffic()
             _tmp = self.adb.compute_traffic_increase(latest, new)
             latest = new
-            logging.debug(f'第[{i + 1}]秒，发送流量{_tmp.tx_total / 1024} kb/s. 接收流量{_tmp.rx_total / 1024} kb/s')
+            logging.debug('第[%s]秒，发送流量%s kb/s. 接收流量%s kb/s', i + 1, _tmp.tx_total / 1024, _tmp.rx_total / 1024)
             traffics.append(_tmp)
             if len(traffics) >= limit_seconds:
                 ok = True
@@ -355,8 +431,9 @@ class AndroidPerfBaseHelperWithWhistle(AndroidPerfBaseHelper, metaclass=abc.ABCM
     见 https://github.com/nic562/whistle.statistics
     """
 
-    def __init__(self, adb: AdbProxyWithToolsAll, whistle_address: str, main_process_only=False):
-        super().__init__(adb, main_process_only)
+    def __init__(self, adb: AdbProxyWithToolsAll, whistle_address: str, main_process_only=False,
+                 memory_by_dumpsys=True):
+        super().__init__(adb, main_process_only, memory_by_dumpsys)
         self.whistle_address = whistle_address
         assert self.whistle_address
 
@@ -1,30 +1,137 @@
+import time
+import types
 from abc import ABCMeta
-import re
 
 from .abstract_adb import AdbInterface
+from .cache import cached_method
+from .log import default as logging
 
 
 class ProcessAdb(AdbInterface, metaclass=ABCMeta):
+    # 只输出需要的列，可减少数倍的传输数据量。旧版本的ps不支持 -o 参数时改为 `ps -A`
+    __ps_cmd = 'ps -A -o PID,PPID,NAME'
+    process_ids_cache_ttl = 2  # find_process_ids 结果的缓存时间，秒。设置为0时不缓存
+
+    def _iter_ps(self, app_bundle: str) -> types.GeneratorType:
+        """
+        迭代包含包名的进程信息
+        :return: (进程ID，父进程ID，进程名) 的迭代
+        """
+        lines = self._stream_shell_lines(self.__ps_cmd)
+        try:
+            yield from self._iter_ps_lines(app_bundle, lines)
+        finally:
+            # 调用方找到目标后提前结束迭代时，同时结束命令输出的读取
+            lines.close()
+
+    def _iter_ps_lines(self, app_bundle: str, lines: types.GeneratorType) -> types.GeneratorType:
+        header = next(lines, '').split()
+        if 'PID' not in header or 'PPID' not in header:
+            if self.__ps_cmd == 'ps -A':
+                logging.warning(f'无法解析进程列表：{header}')
+                return
+            logging.warning(f'`{self.__ps_cmd}` 执行失败，改用 `ps -A`: {header}')
+            self.__ps_cmd = 'ps -A'
+            lines.close()
+            yield from self._iter_ps(app_bundle)
+            return
+        i_pid, i_ppid = header.index('PID'), header.index('PPID')
+        # 不使用 `| grep`，省去设备端额外的进程，直接在本地过滤
+        for x in lines:
+            if app_bundle not in x:
+                continue
+            d = x.split()
+            if len(d) < len(header):
+                logging.warning(f'格式化进程信息异常：{d}')
+                continue
+            yield d[i_pid], d[i_ppid], d[-1]
+
     def find_processes(self, app_bundle: str) -> list:
         """
         每个app可能会有多个进程
         :param app_bundle: 包名
         :return: list: [(进程ID，父进程ID，进程名)]
         """
-        rs = self.run_shell(f'ps -A | grep {app_bundle}')
-        ll = []
-        for x in rs.split('\n'):
-            d = re.split(r'\s+', x)
-            if not d or not d[0]:
-                continue
-            ll.append((d[1], d[2], d[-1]))
-        return ll
+        return list(self._iter_ps(app_bundle))
+
+    def iter_process_ids(self, app_bundle: str) -> types.GeneratorType:
+        """返回进程ID的迭代器，只能遍历一次。需多次遍历、修改或传给批量接口时请使用 find_process_ids
+        结果会缓存 process_ids_cache_ttl 秒，同一秒内的多次采集只需读取一次进程列表
+        """
+        cache = self.__dict__.setdefault('_process_ids_cache', {})
+        now = time.monotonic()
+        c = cache.get(app_bundle)
+        if not c or now - c[0] >= self.process_ids_cache_ttl:
+            c = cache[app_bundle] = (now, [p[0] for p in self.find_processes(app_bundle)])
+        return (p for p in c[1])
 
     def find_process_ids(self, app_bundle: str) -> list:
-        return [p[0] for p in self.find_processes(app_bundle)]
+        """返回进程ID列表(新的列表，调用方可直接修改，不影响缓存)，缓存规则同 iter_process_ids"""
+        return list(self.iter_process_ids(app_bundle))
+
+    def invalidate_process_cache(self, app_bundle: str = None):
+        """清理进程ID缓存，启动或结束应用后调用
+        :param app_bundle: 包名，为空时清理所有应用的缓存
+        """
+        cache = self.__dict__.setdefault('_process_ids_cache', {})
+        prop_cache = self.__dict__.setdefault('_prop_cache', {})
+        if app_bundle is None:
+            cache.clear()
+            for k in [k for k in prop_cache if k[0] == 'find_main_process_id_fast']:
+                prop_cache.pop(k, None)
+            return
+        cache.pop(app_bundle, None)
+        prop_cache.pop(('find_main_process_id_fast', (app_bundle,)), None)
+
+    def _pidof_main(self, app_bundle: str) -> str:
+        """
+        通过 pidof 查找主进程ID，无需解析完整的进程列表。pidof 不可用或未找到时返回None
+        pidof 按进程名匹配，正好只返回主进程(子进程名形如 包名:进程名)；返回多个时再按 cmdline 精确区分
+        """
+        pids = [p for p in self.run_shell(f'pidof {app_bundle}', True).split() if p.isdigit()]
+        if len(pids) < 2:
+            return pids and pids[0] or None
+        # cmdline 以NUL分隔参数，一次读取所有候选进程，每个结果只取第一个参数(进程名)
+        cmdlines = self.run_shell_many([f'cat /proc/{p}/cmdline' for p in pids])
+        for p, c in zip(pids, cmdlines):
+            if c.split('\0', 1)[0] == app_bundle:
+                return p
 
     def find_main_process_id(self, app_bundle: str) -> str:
+        pid = self._pidof_main(app_bundle)
+        if pid:
+            return pid
         for p in self.find_processes(app_bundle):
-            if p[-1].find(':') == -1:
+            if ':' not in p[-1]:
                 return p[0]
         raise ValueError('No Process Found!')
+
+    def wait_main_process_id(self, app_bundle: str, timeout: float = 10, max_interval: float = 0.2) -> str:
+        """
+        等待应用启动并返回主进程ID，重试间隔从8ms开始指数增长，最长不超过 max_interval
+        :param timeout: 最长等待时间，秒。超时抛出 TimeoutError
+        """
+        deadline = time.monotonic() + timeout
+        delay = 0.008
+        while True:
+            try:
+                return self.find_main_process_id(app_bundle)
+            except ValueError:
+                if time.monotonic() + delay > deadline:
+                    raise TimeoutError(f'{timeout}秒内未找到{app_bundle}主进程')
+                logging.debug('重试获取%s主进程id...', app_bundle)
+            time.sleep(delay)
+            delay = min(delay * 2, max_interval)
+
+    @cached_method
+    def find_main_process_id_fast(self, app_bundle: str) -> str:
+        """
+        找到主进程后立即返回，不解析其余进程信息。结果会被缓存，直到调用 kill_app 结束该应用
+        """
+        pid = self._pidof_main(app_bundle)
+        if pid:
+            return pid
+        for p, _, name in self._iter_ps(app_bundle):
+            if name == app_bundle:
+                return p
+        raise ValueError('No Process Found!')
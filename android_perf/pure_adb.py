@@ -1,10 +1,14 @@
+import codecs
 import os
+import subprocess
+import threading
 import types
 
 from ppadb.client import Client as AdbClient
 from ppadb.device import Device
 from ppadb import InstallError
 
+from .abstract_adb import PersistentShell
 from .base_adb import AdbInterface, AdbProxy
 from .log import default as logging
 
@@ -13,28 +17,71 @@ class PureAdb(AdbInterface):
     """
     基于pure-python-adb的封装
     """
+    thread_safe = True  # 每条命令使用独立的socket连接adb server
+
+    # 所有实例共用同一个本地 adb server 客户端，首次创建时检查 adb server 是否已运行，之后连接失败时再重新检查
+    _shared_client: AdbClient = None
+    _shared_client_lock = threading.Lock()
 
     def __init__(self, serial=None):
         self._dev = None
         self.serial = serial
-        self.start_server()
-        self.adb_client = AdbClient()
-        self.connect(serial)
+        self.adb_client = self._get_shared_client()
+        try:
+            self.connect(serial)
+        except RuntimeError:
+            # adb server 可能已被结束(例如 PyAdb 默认会执行 adb kill-server)，重新检查并启动后重试一次
+            if not self._ensure_server(self.adb_client):
+                raise
+            self.connect(serial)
+        # 每个线程使用独立的常驻shell会话，避免线程池中的并发命令在同一会话上排队
+        self._sticky_local = threading.local()
+        self._sticky_all = []
+        self._sticky_lock = threading.Lock()
 
     @classmethod
-    def get_proxy(cls, serial=None) -> AdbProxy:
-        return AdbProxy(cls(serial))
+    def get_proxy(cls, serial=None, sticky_shell=False) -> AdbProxy:
+        return AdbProxy(cls(serial), sticky_shell=sticky_shell)
 
     def get_device(self) -> Device:
         if self._dev:
             return self._dev
         raise RuntimeError("No device is connected! Please call `connect` first!")
 
+    @classmethod
+    def _ensure_server(cls, client: AdbClient) -> bool:
+        """
+        检查 adb server 是否在运行，未运行时才启动，已运行时省去一次进程启动
+        :return: 是否启动了 adb server
+        """
+        try:
+            client.version()
+            return False
+        except RuntimeError:
+            cls.start_server()
+            return True
+
+    @classmethod
+    def _get_shared_client(cls) -> AdbClient:
+        with cls._shared_client_lock:
+            if not cls._shared_client:
+                client = AdbClient()
+                cls._ensure_server(client)
+                cls._shared_client = client
+            return cls._shared_client
+
     @staticmethod
     def start_server():
-        os.system('adb start-server')
+        # 直接执行adb，无需经过shell
+        try:
+            subprocess.run(['adb', 'start-server'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            # 未安装adb或不在PATH中
+            logging.warning(f'启动adb server失败：{e}')
 
     def kill_server(self):
+        # 之后新建的实例需重新检查并启动 adb server
+        PureAdb._shared_client = None
         return self.adb_client.kill()
 
     def version(self):
@@ -62,6 +109,11 @@ class PureAdb(AdbInterface):
         return self._dev
 
     def disconnect(self):
+        with self._sticky_lock:
+            for sh in self._sticky_all:
+                sh.close()
+            self._sticky_all.clear()
+        self._sticky_local = threading.local()
         if self._dev:
             self._dev = None
 
@@ -87,7 +139,7 @@ class PureAdb(AdbInterface):
                     connection.close()
         :return:
         """
-        logging.debug(f'adb shell {cmd}')
+        logging.debug('adb shell %s', cmd)
         rs = self.get_device().shell(cmd, handler=handler, timeout=timeout_ms,
                                      decode=ensure_unicode and 'utf8' or None)
         if clean_wrap and isinstance(rs, str):
@@ -96,12 +148,15 @@ class PureAdb(AdbInterface):
 
     def stream_shell(self, cmd: str) -> types.GeneratorType:
         def handler(connection):
+            # 增量解码，多字节字符被切分在两次读取之间时不会解码出错
+            decoder = codecs.getincrementaldecoder('utf-8')()
             try:
                 while True:
-                    d = connection.read(1024)
+                    d = connection.read(65536)
                     if not d:
                         break
-                    yield d.decode('utf-8')
+                    yield decoder.decode(d)
+                yield decoder.decode(b'', final=True)
             finally:
                 connection.close()
 
@@ -110,6 +165,22 @@ class PureAdb(AdbInterface):
     def run_shell(self, cmd: str, clean_wrap=False) -> str:
         return self.shell(cmd, clean_wrap=clean_wrap)
 
+    def run_shell_sticky(self, cmd: str, clean_wrap=False) -> str:
+        self.get_device()
+        logging.debug('adb shell(Sticky) %s', cmd)
+        rs = self._get_sticky().run(cmd)
+        if clean_wrap:
+            rs = rs.strip()
+        return rs
+
+    def _get_sticky(self) -> PersistentShell:
+        sh = getattr(self._sticky_local, 'shell', None)
+        if not sh:
+            sh = self._sticky_local.shell = PersistentShell(self.serial)
+            with self._sticky_lock:
+                self._sticky_all.append(sh)
+        return sh
+
     def close(self):
         return self.disconnect()
 
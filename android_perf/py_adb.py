@@ -1,4 +1,7 @@
+import functools
 import os
+import subprocess
+import time
 import types
 
 from adb import adb_commands
@@ -15,14 +18,17 @@ class ReadConnectError(Exception):
 
 class PyAdb(AdbInterface):
     """python-adb的封装"""
+    max_reconnect = 3  # run_shell 出现IO读写错误时重新连接的最多次数
 
     @classmethod
     def get_proxy(cls, serial=None) -> AdbProxy:
         return AdbProxy(cls(serial))
 
     @staticmethod
+    @functools.lru_cache(maxsize=None)
     def my_load_rsa_key_path(file_path):
         # 原来的加载方法，在python3中问题兼容性问题
+        # 密钥在进程内不会改变，缓存结果，重新连接时无需再次读取和解析密钥文件
         with open(file_path + '.pub', 'rb') as f:
             pub = f.read()
         with open(file_path, 'rb') as f:
@@ -46,11 +52,18 @@ class PyAdb(AdbInterface):
             return cls.connect_dev(adb_key_path, serial=serial)
         return dev
 
-    def __init__(self, serial=None, adb_key_path='~/.android/adbkey', auto_connect=True):
-        try:
-            os.system('adb kill-server')
-        except:
-            pass
+    def __init__(self, serial=None, adb_key_path='~/.android/adbkey', auto_connect=True, reset_server=True):
+        """
+        :param reset_server: 是否先结束本机的adb server。python-adb 直接通过USB与设备通讯，
+            adb server 运行时会占用设备导致无法连接；确认 adb server 未运行(或通过TCP连接)时可设置为False，
+            避免结束 adb server 影响其他正在使用adb的程序，也省去一次进程启动的耗时
+        """
+        if reset_server:
+            try:
+                # 直接执行adb，无需经过shell
+                subprocess.run(['adb', 'kill-server'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except OSError:
+                pass
         self.serial = serial
         self.adb_key_path = adb_key_path
         self._adb = None
@@ -68,37 +81,38 @@ class PyAdb(AdbInterface):
 
     def open_connect(self) -> adb_commands.AdbCommands:
         self._adb = self.connect_dev(self.adb_key_path, serial=self.serial)
+        if not self.serial:
+            # 未指定设备时记录实际连接的设备号，重新连接时仍连接同一设备，也用于按设备号共享的缓存
+            handle = getattr(self._adb, '_handle', None)
+            self.serial = getattr(handle, 'serial_number', None) or \
+                self._adb.Shell('getprop ro.serialno').strip() or None
         return self._adb
 
-    def _on_read_error(self, e, cmd, clean_wrap, reconnect_on_err):
-        if reconnect_on_err:
-            logging.warning('trying to reconnect adb!')
-            self.adb.Close()
-            self.open_connect()
-            return self.run_shell(cmd, clean_wrap, reconnect_on_err)
-        else:
-            raise ReadConnectError(e)
-
     def run_shell(self, cmd: str, clean_wrap=False, reconnect_on_err=True) -> str:
         """
         执行命令
         :param cmd: 命令内容
         :param clean_wrap: 是否清理结果换行
-        :param reconnect_on_err: 命令执行过程中出现IO读写的错误时重新连接. 如果为False，则发生错误时将报错 ReadConnectError
+        :param reconnect_on_err: 命令执行过程中出现IO读写的错误时重新连接，最多重试 max_reconnect 次，
+            重试间隔从50ms开始指数增长。如果为False或重试后仍然失败，则报错 ReadConnectError
         :return:
         """
-        logging.debug(f'adb shell {cmd}')
-        try:
-            rs = self.adb.Shell(cmd)
-            if clean_wrap:
-                rs = rs.strip()
-            return rs
-        except InvalidResponseError as e:
-            return self._on_read_error(e, cmd, clean_wrap, reconnect_on_err)
-        except InvalidCommandError as e:
-            return self._on_read_error(e, cmd, clean_wrap, reconnect_on_err)
-        except AttributeError as e:
-            return self._on_read_error(e, cmd, clean_wrap, reconnect_on_err)
+        logging.debug('adb shell %s', cmd)
+        attempt = 0
+        while True:
+            try:
+                rs = self.adb.Shell(cmd)
+                if clean_wrap:
+                    rs = rs.strip()
+                return rs
+            except (InvalidResponseError, InvalidCommandError, AttributeError) as e:
+                if not reconnect_on_err or attempt >= self.max_reconnect:
+                    raise ReadConnectError(e) from e
+                logging.warning('trying to reconnect adb!')
+                time.sleep(0.05 * 2 ** attempt)
+                attempt += 1
+                self.adb.Close()
+                self.open_connect()
 
     def stream_shell(self, cmd: str) -> types.GeneratorType:
         """
@@ -106,7 +120,7 @@ class PyAdb(AdbInterface):
         :param cmd: 命令内容
         :return: 每行输出结果迭代
         """
-        logging.debug(f'adb shell(Streaming) {cmd}')
+        logging.debug('adb shell(Streaming) %s', cmd)
         return self.adb.StreamingShell(cmd)
 
     def install_app(self, apk_path):
@@ -12,21 +12,19 @@ class SurfaceAdb(AdbInterface, metaclass=ABCMeta):
         """
         通过dumpsys window windows获取activity名称
         """
-        activity_name = ''
-        activity_line = ''
-        for line in self.run_shell('dumpsys window windows').split('\n'):
-            if line.find('mCurrentFocus') != -1:
-                activity_line = line.strip()
-        if activity_line:
-            activity_line_split = activity_line.split(' ')
-        else:
-            return activity_name
-        if len(activity_line_split) > 1:
-            if activity_line_split[1] == 'u0':
-                activity_name = activity_line_split[2].rstrip('}')
-            else:
-                activity_name = activity_line_split[1]
-        return activity_name
+        # 逐行读取，找到焦点窗口后即停止，不再读取和切分其余的大段输出
+        lines = self._stream_shell_lines('dumpsys window windows')
+        try:
+            activity_line = next((x.strip() for x in lines if 'mCurrentFocus' in x), '')
+        finally:
+            # 立即结束剩余输出的读取(单连接的实现会读完剩余数据)，不留给同一连接上的下一条命令
+            lines.close()
+        if ' ' not in activity_line:
+            return ''
+        # 形如 mCurrentFocus=Window{1a2b3c u0 包名/Activity名}，所需的部分为最后一段
+        if ' u0 ' in activity_line:
+            return activity_line.rpartition(' ')[2].rstrip('}')
+        return activity_line.split(' ', 2)[1]
 
     def clear_surfaceflinger(self, win_name: str = ''):
         return self.run_shell(f'dumpsys SurfaceFlinger --latency-clear {win_name}')
@@ -1,5 +1,4 @@
 from abc import ABCMeta
-import re
 import time
 
 from .abstract_adb import AdbInterface
@@ -57,45 +56,40 @@ class TrafficAdb(AdbInterface, metaclass=ABCMeta):
         # 状态字参考:https://users.cs.northwestern.edu/~agupta/cs340/project2/TCPIP_State_Transition_Diagram.pdf
         # https://guanjunjian.github.io/2017/11/09/study-8-proc-net-tcp-analysis/
         # https://zhuanlan.zhihu.com/p/49981590
-        rs = self.run_shell(f'cat /proc/net/{target_net_file} | grep {uid}')
+        # 在设备端按第8列(uid)精确过滤，只传输匹配的行；grep 还会匹配到其他列中包含uid的行
+        rs = self.run_shell(f"awk -v u={uid} '$8==u' /proc/net/{target_net_file}")
         if rs:
-            ll = []
-            for r in rs.split('\n'):
-                if not r:
-                    continue
-                m = re.split(r'\s+', r.strip())
-                if m and m[7] == uid:
-                    ll.append(m)
-            return ll
+            return [m for m in (r.split() for r in rs.split('\n')) if m]
 
     @staticmethod
     def _traffic_parse_line(rs: str):
         # 原始数据的每一行，第2个信息为接收流量，第10个信息为发送流量
-        items = rs.split()
+        items = rs.split(None, 10)  # 只需前10列，其余不再切分
         return int(items[1]), int(items[9])
 
     def _traffic_parse(self, rs: str, start_ms: int, unit: DataUnit = None):
-        if rs.find('No such') != -1:
-            # 进程有可能被销毁
-            raise KeyError(f'Bad return: {rs}')
-        if rs.find('error') != -1:
-            raise ValueError(f'Error return: {rs}')
-        end_ms = int(time.time() * 1000)
+        end_ms = int(time.monotonic() * 1000)
         info = NetTraffic(unit=unit)
         info.cost_ms = end_ms - start_ms
+        # 一次遍历同时检查错误信息和解析网卡数据
         for line in rs.split('\n'):
             if 'wlan0' in line:
                 # wifi 流量
                 info.wifi_rx_byte, info.wifi_tx_byte = self._traffic_parse_line(line)
             elif 'rmnet0' in line:
                 info.mobile_rx_byte, info.mobile_tx_byte = self._traffic_parse_line(line)
+            elif 'No such' in line:
+                # 进程有可能被销毁
+                raise KeyError(f'Bad return: {rs}')
+            elif 'error' in line:
+                raise ValueError(f'Error return: {rs}')
         return info.compute_total()
 
     def get_device_traffic(self, unit: DataUnit = None) -> NetTraffic:
         """获取设备整机流量统计
         注意：该数据为设备启动（重启后归0）后开始累计的
         """
-        _t = int(time.time() * 1000)
+        _t = int(time.monotonic() * 1000)
         rs = self.run_shell('cat /proc/net/dev', clean_wrap=True)
         return self._traffic_parse(rs, _t, unit=unit)
 
@@ -109,10 +103,35 @@ class TrafficAdb(AdbInterface, metaclass=ABCMeta):
         获取具体进程所属App的流量统计，结果是从设备启动开始开始的累计值
         虽然进程文件在进程销毁后就删掉，但是所属应用的流量统计并不清0
         """
-        _t = int(time.time() * 1000)
+        _t = int(time.monotonic() * 1000)
         rs = self.run_shell(f'cat /proc/{pid}/net/dev', clean_wrap=True)
         return self._traffic_parse(rs, _t, unit=unit)
 
+    def get_processes_traffic(self, process_id_list: list, unit: DataUnit = None,
+                              auto_remove_miss_process=True) -> list:
+        """
+        通过一次adb shell读取多个进程的流量统计，说明参考 get_process_traffic
+        注意：同一App的进程所得数据基本一致，结果不能直接相加
+        :param process_id_list: 进程ID列表
+        :param auto_remove_miss_process: 是否从process_id_list中清理不存在进程ID
+        :return: 各存活进程的流量统计，已销毁的进程不在结果中
+        """
+        if not process_id_list:
+            return []
+        _t = int(time.monotonic() * 1000)
+        rs = self.run_shell_many([f'cat /proc/{p}/net/dev' for p in process_id_list], clean_wrap=True)
+        traffics = []
+        miss_pids = set()
+        for p, r in zip(process_id_list, rs):
+            try:
+                traffics.append(self._traffic_parse(r, _t, unit=unit))
+            except KeyError:
+                # 进程有可能被销毁
+                miss_pids.add(p)
+        if miss_pids and auto_remove_miss_process:
+            process_id_list[:] = [p for p in process_id_list if p not in miss_pids]
+        return traffics
+
     @staticmethod
     def compute_traffic_increase(start_traffic: NetTraffic, end_traffic: NetTraffic,
                                  unit: DataUnit = None) -> NetTraffic:
@@ -1,15 +1,52 @@
 # coding=utf8
 # 基于whistle代理插件（https://github.com/nic562/whistle.statistics）的http请求统计
-from urllib import request
+import http.client
+import threading
 import simplejson
 
+# 按代理地址复用 keep-alive 连接，避免每次请求都重新建立TCP连接
+# HTTPConnection 非线程安全，每个地址使用独立的锁，全局锁只在查找或创建连接时持有，不影响其他地址的请求
+_connections = {}  # {whistle_address: (lock, conn)}
+_connections_lock = threading.Lock()
+# 复用的空闲连接已被服务端关闭时出现的错误，此时请求未被处理，可安全地重新发送；其他错误(如超时)不重试，避免重复提交
+_STALE_CONNECTION_ERRORS = (ConnectionResetError, BrokenPipeError, http.client.RemoteDisconnected)
+
+
+def _request(conn: http.client.HTTPConnection, uri, body: bytes = None) -> (int, str):
+    # 与 urllib.request.urlopen 一致：有数据时以表单方式POST
+    headers = body and {'Content-Type': 'application/x-www-form-urlencoded'} or {}
+    conn.request(body and 'POST' or 'GET', uri, body=body, headers=headers)
+    resp = conn.getresponse()
+    # 需读取完整响应后连接才能复用
+    return resp.status, resp.read().decode('utf8')
+
+
+def _get_connection(whistle_address: str) -> (threading.Lock, http.client.HTTPConnection):
+    with _connections_lock:
+        c = _connections.get(whistle_address)
+        if not c:
+            c = _connections[whistle_address] = (threading.Lock(), http.client.HTTPConnection(whistle_address, timeout=10))
+        return c
+
 
 def _call_proxy_request(whistle_address: str, uri, data: str = None):
-    resp = request.urlopen(f'http://{whistle_address}{uri}', data=data and data.encode('utf8') or None, timeout=10)
-    body = resp.read().decode('utf8')
-    if resp.status == 200:
-        return True, simplejson.loads(body)
-    return False, body
+    body = data and data.encode('utf8') or None
+    lock, conn = _get_connection(whistle_address)
+    with lock:
+        try:
+            try:
+                status, rs = _request(conn, uri, body)
+            except _STALE_CONNECTION_ERRORS:
+                # 服务端已关闭空闲连接时重新连接一次
+                conn.close()
+                status, rs = _request(conn, uri, body)
+        except BaseException:
+            # 连接状态未知，关闭后下次请求重新建立连接
+            conn.close()
+            raise
+    if status == 200:
+        return True, simplejson.loads(rs)
+    return False, rs
 
 
 def active_statistics_status(whistle_address: str, active: bool = True):
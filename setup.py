@@ -21,7 +21,8 @@ setup(
     install_requires=parse_requirements('requirements.txt'),
     extras_require={
         'py-adb': ['adb~=1.3.0.1'],
-        'pure-adb': ['pure-python-adb~=0.3.1']
+        'pure-adb': ['pure-python-adb~=0.3.1'],
+        'numpy': ['numpy'],
     },
     classifiers=[
         'Programming Language :: Python :: 3.6',
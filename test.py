@@ -4,29 +4,47 @@ from logging import DEBUG
 
 from android_perf.log import default_stream_handler as logging_handler, default as logging
 from android_perf.base_adb import AdbProxy
-from android_perf.py_adb import PyAdb
-from android_perf.pure_adb import PureAdb
 from android_perf.adb_with_tools import AdbProxyWithToolsAll, AppInfo
 
 
+def wait_traffic_stable(adb: AdbProxy, pid: str, min_seconds: float = 0.3, max_seconds: float = 2,
+                        interval: float = 0.1, eps: int = 64):
+    """
+    每隔 interval 秒读取一次进程流量，连续两次增量都小于 eps 字节(且至少等待 min_seconds 秒)时返回，最长等待 max_seconds 秒
+    """
+    start = time.monotonic()
+    prev = adb.get_process_traffic(pid)
+    stable = 0
+    while time.monotonic() - start < max_seconds:
+        time.sleep(interval)
+        curr = adb.get_process_traffic(pid)
+        inc = adb.compute_traffic_increase(prev, curr)
+        stable = inc.rx_total + inc.tx_total < eps and stable + 1 or 0
+        if stable >= 2 and time.monotonic() - start >= min_seconds:
+            return
+        prev = curr
+
+
 def get_perf(adb: AdbProxy, bundle: str = None):
     print('\nsdk version:', adb.get_sdk_version())
     print('\ndevice info:', adb.get_device_info())
-    print('\ndevice memory:', adb.get_device_memory())
-    print('\ndevice cpu time:', adb.get_cpu_global())
-    print('\ndevice netflow:', adb.get_device_traffic())
+    memory, cpu, traffic = adb.get_device_snapshot()
+    print('\ndevice memory:', memory)
+    print('\ndevice cpu time:', cpu)
+    print('\ndevice netflow:', traffic)
     if bundle:
         print('\nstart app:', bundle)
         adb.launch_app(bundle)
-        time.sleep(0.1)
-        main_pid = adb.find_main_process_id(bundle)
+        main_pid = adb.wait_main_process_id(bundle)
         start_traffic = adb.get_process_traffic(main_pid)
-        time.sleep(2)
+        wait_traffic_stable(adb, main_pid)
         pl = adb.find_process_ids(bundle)
-        print('\napp memory:', adb.get_processes_memory(pl))
-        print('\napp cpu time:', adb.get_processes_cpu_usage(pl))
+        # 进程CPU时间与内存数据通过一次adb shell读取
+        _, app_cpu, app_memory = adb.get_tick_snapshot(pl)
+        print('\napp memory:', app_memory)
+        print('\napp cpu time:', app_cpu)
         print('\napp netflow:', adb.compute_traffic_increase(start_traffic, adb.get_process_traffic(main_pid)))
-        adb.kill_app(bundle)
+        adb.kill_app_async(bundle)
 
 
 def test_record(adb: AdbProxyWithToolsAll):
@@ -51,7 +69,7 @@ def test_netflow(adb: AdbProxyWithToolsAll, bundle: str = None):
     net = adb.finish2format_statistics_net_traffic()
     for n in net:
         print(f'Down:{n["down"]} # Up:{n["up"]}')
-    adb.kill_app(bundle)
+    adb.kill_app_async(bundle)
 
 
 def set_debug():
@@ -60,20 +78,31 @@ def set_debug():
 
 
 if __name__ == '__main__':
+    # adb底层实现依赖第三方库，只在直接运行时导入，以便其他脚本可单独导入本文件中的函数
+    from android_perf.py_adb import PyAdb
+    from android_perf.pure_adb import PureAdb
+
     _app = len(sys.argv) > 1 and sys.argv[1] or None
     _debug = len(sys.argv) > 2
     if _debug:
         set_debug()
     py_adb = PyAdb(auto_connect=False)
-    print('py-adb devices:', py_adb.devices())
+    _devices = py_adb.devices()
+    print('py-adb devices:', _devices)
+    if not _devices:
+        # 未连接设备时后续的操作都会失败，直接退出
+        logging.warning('No devices!')
+        sys.exit(0)
     py_adb.open_connect()
     with AdbProxy(py_adb) as _adb:
         get_perf(_adb, _app)
 
-    with AdbProxy(PureAdb()) as _adb:
+    # 通过常驻的adb shell会话执行命令，省去每条命令建立shell连接的开销
+    with AdbProxy(PureAdb(), sticky_shell=True) as _adb:
         print('pure-adb devices:', _adb.devices())
         get_perf(_adb, _app)
 
     with AdbProxyWithToolsAll(PureAdb()) as _adb:
         test_record(_adb)
-        test_netflow(_adb, _app)
+        if _app:
+            test_netflow(_adb, _app)